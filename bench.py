@@ -0,0 +1,214 @@
+"""Benchmarks for the response pipeline of eliza.py and my_eliza.py.
+
+Each engine is run over several input corpora. For every corpus the report
+gives the mean time per input of each pipeline stage, timed in isolation,
+and the end-to-end respond() time. It also gives the memory taken by a
+loaded script and the memory held per session after a short conversation,
+both as allocated and as reported by Session.footprint(). Results are
+written as JSON so runs from different commits can be compared with
+--compare.
+"""
+import argparse
+import gc
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from eliza import SCRIPTS, load_engine
+
+log = logging.getLogger(__name__)
+
+REALISTIC = [
+    'Men are all alike.',
+    'They\'re always bugging us about something or other.',
+    'Well, my boyfriend made me come here.',
+    'He says I\'m depressed much of the time.',
+    'It\'s true. I am unhappy.',
+    'I need some help, that much seems certain.',
+    'Perhaps I could learn to get along with my mother.',
+    'My mother takes care of me.',
+    'You are like my father in some ways.',
+    'You don\'t argue with me.',
+    'My father is afraid of everybody.',
+    'Bullies.',
+]
+
+SHORT = ['yes', 'no', 'maybe', 'ok', 'sorry', 'hello', 'why?', 'I see.']
+
+FILLER = ('the', 'day', 'was', 'long', 'and', 'my', 'work', 'felt', 'heavy',
+          'but', 'friends', 'called', 'so', 'it', 'got', 'better', 'again')
+
+CRISIS = [
+    'I want to die.',
+    'Sometimes I think about suicide.',
+    'I don\'t want to live like this anymore.',
+]
+
+
+def _paragraph(rng, length):
+    return ' '.join(rng.choice(FILLER) for _ in range(length)) + '.'
+
+
+def build_corpora(size=200, seed=0):
+    """Return the benchmark corpora as a dict of name to list of inputs."""
+    rng = random.Random(seed)
+    return {
+        'short': [rng.choice(SHORT) for _ in range(size)],
+        'realistic': [rng.choice(REALISTIC) for _ in range(size)],
+        'paragraph': [_paragraph(rng, rng.randint(80, 200))
+                      for _ in range(size)],
+        # many wildcard keys in one long input so multi-'*' decomps are tried
+        'wildcard': [' '.join([_paragraph(rng, 40), 'i am', _paragraph(rng, 40),
+                               'sad because my mother said i was',
+                               _paragraph(rng, 40), 'you are like me'])
+                     for _ in range(size)],
+        'crisis': [rng.choice(CRISIS) for _ in range(size)],
+    }
+
+
+def _timed(func, inputs):
+    start = time.perf_counter()
+    for item in inputs:
+        func(item)
+    return time.perf_counter() - start
+
+
+def time_stages(engine, texts):
+    """Return the mean seconds per input of each stage over texts."""
+    stages = {}
+    # punctuation cleanup, splitting and pre-substitution are one pass
+    stages['tokenize'] = _timed(engine._tokenize, texts)
+    tokenized = [engine._tokenize(text) for text in texts]
+    cleaned = [' '.join(tokens) for tokens, _, _ in tokenized]
+    words = [words for _, words, _ in tokenized]
+    lowered = [lowered for _, _, lowered in tokenized]
+    stages['sort_keys'] = _timed(engine._sorted_keys, lowered)
+
+    # every decomp of every matching key, as a worst case for _match_decomp
+    attempts = [(w, d) for w in lowered for k in engine._sorted_keys(w)
+                for d in k.decomps]
+    stages['match_decomp'] = _timed(lambda a: a[1].matcher.spans(a[0]),
+                                    attempts)
+    matched = [(d.templates[0], r) for w, d in attempts
+               for r in [d.matcher.match(w)]
+               if r is not None and d.reasmbs[0][0] != 'goto']
+    stages['reassemble'] = _timed(lambda m: engine._reassemble(*m), matched)
+
+    if hasattr(engine, 'noun_phrases'):
+        engine.sentiment_cache.data.clear()
+        if engine.sia is not None:
+            stages['sentiment'] = _timed(engine.sentiment_score, cleaned)
+        engine.noun_phrase_cache.data.clear()
+        if engine._nlp_model('tagger') is not None:
+            stages['pos_tagging'] = _timed(engine.noun_phrases, words)
+
+    session = engine.new_session()
+    stages['respond'] = _timed(lambda text: engine.respond(text, session), texts)
+    return dict((name, seconds / len(texts)) for name, seconds in stages.items())
+
+
+def engine_memory(engine, script):
+    """Return the bytes allocated by a fresh engine loading script."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fresh = type(engine)()
+    fresh.load(script, cache=False)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+
+def session_memory(engine, texts, sessions=200):
+    """Return the mean bytes allocated and the mean session footprint."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = []
+    for _ in range(sessions):
+        session = engine.new_session()
+        for text in texts:
+            engine.respond(text, session)
+        kept.append(session)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    footprint = sum(session.footprint() for session in kept)
+    return (after - before) / float(sessions), footprint / float(sessions)
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       universal_newlines=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(engines=('eliza', 'my_eliza'), size=200, seed=0):
+    corpora = build_corpora(size, seed)
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'time': time.time(),
+        'size': size,
+        'engines': {},
+    }
+    for name in engines:
+        engine = load_engine(name, crisis_report_path=None)
+        random.seed(seed)
+        engine_results = {'corpora': {},
+                          'engine_bytes': engine_memory(engine, SCRIPTS[name])}
+        for corpus, texts in sorted(corpora.items()):
+            engine_results['corpora'][corpus] = time_stages(engine, texts)
+        (engine_results['session_bytes'],
+         engine_results['session_footprint']) = session_memory(engine, REALISTIC)
+        results['engines'][name] = engine_results
+    return results
+
+
+def compare(old, new):
+    """Yield (engine, corpus, stage, old, new) for every stage in both runs."""
+    for name, engine in sorted(new['engines'].items()):
+        old_engine = old['engines'].get(name, {}).get('corpora', {})
+        for corpus, stages in sorted(engine['corpora'].items()):
+            for stage, seconds in sorted(stages.items()):
+                before = old_engine.get(corpus, {}).get(stage)
+                if before is not None:
+                    yield name, corpus, stage, before, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', action='append', choices=sorted(SCRIPTS))
+    parser.add_argument('--size', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    parser.add_argument('--compare', help='earlier JSON results to compare')
+    args = parser.parse_args()
+
+    results = run(args.engine or sorted(SCRIPTS), args.size, args.seed)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)
+        for name, corpus, stage, before, after in compare(old, results):
+            sys.stderr.write('{:9} {:10} {:13} {:10.1f}us {:10.1f}us {:+7.1%}\n'.format(
+                name, corpus, stage, before * 1e6, after * 1e6,
+                after / before - 1 if before else 0))
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    main()
@@ -0,0 +1,324 @@
+"""Worker processes for serving Eliza from more than one core.
+
+A WorkerPool starts N processes, each loading the script once and keeping
+the sessions routed to it. Sessions are assigned to workers by consistent
+hashing of the session id, so every turn of a conversation reaches the
+same worker, and adding or removing a worker moves only the sessions whose
+place on the ring changed. Moved sessions are carried over as snapshots
+(see Eliza.dump_session()).
+
+The pool is driven from an asyncio event loop. Requests are written to a
+worker's pipe by a sender thread of its own and replies are read back by
+a loop reader, so the front end never blocks on a worker.
+
+A worker that dies is replaced by a new process under the same name, so it
+takes the same place on the ring and no other worker's sessions move. The
+sessions it held are lost: their turns in flight fail with WorkerError, and
+their next turns start new conversations on the replacement.
+"""
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+
+from eliza import load_engine
+
+log = logging.getLogger(__name__)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'),
+                                          digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hash ring with replicas virtual points per node."""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.points = []    # sorted (hash, node)
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(node for _, node in self.points))
+
+    def add(self, node):
+        for i in range(self.replicas):
+            bisect.insort(self.points, (_hash('{}:{}'.format(node, i)), node))
+
+    def remove(self, node):
+        self.points = [point for point in self.points if point[1] != node]
+
+    def node_for(self, key):
+        if not self.points:
+            raise LookupError('Hash ring is empty')
+        index = bisect.bisect(self.points, (_hash(key),))
+        return self.points[index % len(self.points)][1]
+
+
+def _worker_main(conn, name, script, options, reload):
+    engine = load_engine(name, script, **options)
+    swaps = []
+    if reload:
+        # swapped in between requests, never during a respond()
+        engine.watch(script, schedule=lambda swap, state: swaps.append(state))
+    sessions = {}
+    while True:
+        try:
+            op, request_id, session_id, arg = conn.recv()
+        except EOFError:
+            break
+        while swaps:
+            engine.swap_script(swaps.pop(0))
+        try:
+            if op == 'respond':
+                session = sessions.get(session_id)
+                if session is None:
+                    session = sessions[session_id] = engine.new_session(session_id)
+                result = engine.respond(arg, session)
+            elif op == 'close':
+                result = sessions.pop(session_id, None) is not None
+            elif op == 'export':
+                session = sessions.pop(session_id, None)
+                result = None if session is None else engine.dump_session(session)
+            elif op == 'import':
+                session = engine.load_session(arg)
+                sessions[session.id] = session
+                result = True
+            elif op == 'stop':
+                conn.send((request_id, True, None))
+                break
+            else:
+                raise ValueError("Unknown request {}".format(op))
+        except Exception as e:
+            log.exception('Worker request %s failed', op)
+            conn.send((request_id, False, repr(e)))
+        else:
+            conn.send((request_id, True, result))
+    conn.close()
+
+
+class WorkerError(Exception):
+    pass
+
+
+class Worker:
+    """A worker process and the parent's end of its pipe.
+
+    send() only queues a request. The sender thread writes it to the pipe,
+    so the event loop keeps reading replies while a long request waits for
+    room in the pipe; otherwise the two processes could each block writing
+    to the other. on_error(worker, error) is called on the event loop if a
+    write fails.
+    """
+
+    def __init__(self, name, process, conn, max_pending, on_error):
+        self.name = name
+        self.process = process
+        self.conn = conn
+        self.pending = {}   # request id -> future
+        self.stopping = False
+        self.lost = False
+        # bounds the requests queued or running in the worker
+        self.slots = asyncio.Semaphore(max_pending)
+        self.loop = asyncio.get_running_loop()
+        self.on_error = on_error
+        self.outbox = queue.Queue()
+        self.sender = threading.Thread(target=self._run,
+                                       name='{}-sender'.format(name))
+        self.sender.daemon = True
+        self.sender.start()
+
+    def send(self, request):
+        self.outbox.put(request)
+
+    def close(self):
+        """Close the pipe once the requests queued so far are written."""
+        self.outbox.put(None)
+
+    def _run(self):
+        failed = False
+        while True:
+            request = self.outbox.get()
+            if request is None:
+                break
+            if failed:
+                continue
+            try:
+                self.conn.send(request)
+            except OSError as e:
+                failed = True
+                try:
+                    self.loop.call_soon_threadsafe(self.on_error, self, e)
+                except RuntimeError:
+                    pass    # the event loop is closed
+        self.conn.close()
+
+
+class WorkerPool:
+    def __init__(self, engine='eliza', script=None, workers=None, reload=False,
+                 replicas=64, max_pending=256, **options):
+        self.engine = engine
+        self.script = script
+        self.size = workers or multiprocessing.cpu_count()
+        self.reload = reload
+        self.options = options
+        self.max_pending = max_pending
+        self.ring = HashRing(replicas=replicas)
+        self.workers = {}
+        self.sessions = set()   # ids of sessions with at least one turn
+        self.ready = asyncio.Event()
+        self.request_ids = itertools.count()
+        self.names = ('worker-{}'.format(i) for i in itertools.count())
+        # spawn, so workers do not inherit the event loop or other threads
+        self.context = multiprocessing.get_context('spawn')
+
+    async def start(self):
+        for _ in range(self.size):
+            self._start_worker()
+        self.ready.set()
+
+    def _start_worker(self, name=None):
+        parent, child = self.context.Pipe()
+        name = name or next(self.names)
+        process = self.context.Process(
+            target=_worker_main, name=name, daemon=True,
+            args=(child, self.engine, self.script, self.options, self.reload))
+        process.start()
+        child.close()
+        worker = Worker(name, process, parent, self.max_pending, self._lost)
+        asyncio.get_running_loop().add_reader(parent.fileno(), self._on_reply,
+                                              worker)
+        self.workers[name] = worker
+        self.ring.add(name)
+        return worker
+
+    def _on_reply(self, worker):
+        try:
+            while worker.conn.poll():
+                request_id, ok, result = worker.conn.recv()
+                future = worker.pending.pop(request_id)
+                if future.cancelled():
+                    continue
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(WorkerError(result))
+        except (EOFError, OSError) as e:
+            self._lost(worker, e)
+
+    def _lost(self, worker, error):
+        if worker.lost:
+            return      # already handled
+        worker.lost = True
+        asyncio.get_running_loop().remove_reader(worker.conn.fileno())
+        worker.close()
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(WorkerError('{} exited'.format(worker.name)))
+        worker.pending.clear()
+        if worker.stopping:
+            return
+
+        log.error('Lost %s: %s; starting a replacement', worker.name, error)
+        lost = set(id for id in self.sessions
+                   if self.ring.node_for(id) == worker.name)
+        self.sessions -= lost
+        self.ring.remove(worker.name)
+        del self.workers[worker.name]
+        self._start_worker(worker.name)
+        log.info('Started a new %s; %d sessions were lost', worker.name,
+                 len(lost))
+
+    def _send(self, worker, op, session_id, arg):
+        request_id = next(self.request_ids)
+        if worker.lost:
+            raise WorkerError('{} exited'.format(worker.name))
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = future
+        worker.send((op, request_id, session_id, arg))
+        return future
+
+    async def _call(self, worker, op, session_id=None, arg=None):
+        async with worker.slots:
+            return await self._send(worker, op, session_id, arg)
+
+    def worker_for(self, session_id):
+        return self.workers[self.ring.node_for(session_id)]
+
+    async def respond(self, session_id, text):
+        while True:
+            await self.ready.wait()
+            worker = self.worker_for(session_id)
+            await worker.slots.acquire()
+            # a rebalance may have started while waiting for the slot
+            if self.ready.is_set():
+                break
+            worker.slots.release()
+        try:
+            self.sessions.add(session_id)
+            return await self._send(worker, 'respond', session_id, text)
+        finally:
+            worker.slots.release()
+
+    async def close_session(self, session_id):
+        await self.ready.wait()
+        if session_id in self.sessions:
+            self.sessions.discard(session_id)
+            await self._call(self.worker_for(session_id), 'close', session_id)
+
+    async def _rebalance(self, change):
+        # Routing pauses while sessions move. Turns already sent to a worker
+        # are ahead of the export in its pipe, so none are lost.
+        self.ready.clear()
+        try:
+            owners = dict((id, self.ring.node_for(id)) for id in self.sessions)
+            result = change()
+            moved = 0
+            for session_id, old in owners.items():
+                new = self.ring.node_for(session_id)
+                if new == old:
+                    continue
+                data = await self._call(self.workers[old], 'export', session_id)
+                if data is not None:
+                    await self._call(self.workers[new], 'import', None, data)
+                moved += 1
+            log.info('Moved %d of %d sessions', moved, len(owners))
+            return result
+        finally:
+            self.ready.set()
+
+    async def add_worker(self):
+        """Start one more worker and move the sessions it now owns to it."""
+        worker = await self._rebalance(self._start_worker)
+        return worker.name
+
+    async def remove_worker(self, name):
+        """Move a worker's sessions to the others and stop it."""
+        worker = self.workers[name]
+        if len(self.workers) == 1:
+            raise ValueError('Cannot remove the last worker')
+        await self._rebalance(lambda: self.ring.remove(name))
+        await self._stop_worker(worker)
+
+    async def _stop_worker(self, worker):
+        worker.stopping = True
+        try:
+            await self._call(worker, 'stop')
+        except WorkerError:
+            pass
+        self._lost(worker, None)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, worker.sender.join, 5)
+        await loop.run_in_executor(None, worker.process.join, 5)
+        del self.workers[worker.name]
+
+    async def close(self):
+        for worker in list(self.workers.values()):
+            self.ring.remove(worker.name)
+            await self._stop_worker(worker)
@@ -0,0 +1,164 @@
+"""Crisis phrase detection and report writing for my_eliza.py.
+
+Phrases come from a lexicon file and are compiled into an Aho-Corasick
+automaton, so every phrase is looked for in one scan of the input and the
+cost of a turn does not grow with the size of the lexicon.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+LEXICON = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'crisis_lexicon.txt')
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('\u2019', "'").split())
+
+
+def load_lexicon(path=LEXICON):
+    """Return the distinct phrases in a lexicon file, in file order."""
+    phrases = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                phrases.append(line)
+    return list(dict.fromkeys(phrases))
+
+
+class PhraseMatcher:
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        self.phrases = []
+        for phrase in phrases:
+            self._add(phrase)
+        self._link()
+
+    def _add(self, phrase):
+        # A '*' at either end drops the word-boundary check on that side
+        left = not phrase.startswith('*')
+        right = not phrase.endswith('*')
+        pattern = normalize(phrase.strip('*'))
+        if not pattern:
+            raise ValueError("Empty crisis phrase {!r}".format(phrase))
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.out[state].append((phrase, len(pattern), left, right))
+        self.phrases.append(phrase)
+
+    def _link(self):
+        # Breadth-first, so each state's failure link is final before its
+        # children use it
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child].extend(self.out[self.fail[child]])
+
+    def find(self, text):
+        """Return the phrases found in text, in order of first match."""
+        text = normalize(text)
+        goto = self.goto
+        fail = self.fail
+        found = []
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for phrase, length, left, right in self.out[state]:
+                start = end - length
+                if left and start > 0 and text[start - 1].isalnum():
+                    continue
+                if right and end < len(text) and text[end].isalnum():
+                    continue
+                if phrase not in found:
+                    found.append(phrase)
+        return found
+
+
+# Tells the writer thread to stop once everything queued before it is written
+_STOP = object()
+
+
+class ReportWriter:
+    """Appends crisis reports to a JSONL file from a background thread.
+
+    write() only queues the report, so a chat turn never waits on disk. The
+    thread writes whatever has queued up in one go and fsyncs once per
+    batch. The file is opened in append mode, so reports are never
+    overwritten. It is opened here, so a path that cannot be written
+    raises OSError at once rather than losing reports later. A report that
+    cannot be serialized is logged and skipped.
+    """
+
+    def __init__(self, path, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self.file = open(path, 'a', encoding='utf-8')
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='crisis-reports')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, report):
+        self.queue.put(report)
+
+    def flush(self):
+        """Block until every report written so far is on disk."""
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+
+    def _run(self):
+        with self.file as file:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    lines = []
+                    for report in batch:
+                        if report is _STOP:
+                            continue
+                        try:
+                            lines.append(json.dumps(report) + '\n')
+                        except (TypeError, ValueError):
+                            log.exception('Could not serialize crisis report '
+                                          '%r', report)
+                    file.writelines(lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                except OSError:
+                    log.exception('Could not write crisis reports to %s',
+                                  self.path)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+                if _STOP in batch:
+                    return
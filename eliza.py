@@ -1,7 +1,17 @@
+import argparse
+import copy
+import hashlib
+import importlib
+import json
 import logging
+import marshal
+import os
 import random
 import re
-from collections import namedtuple
+import sys
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
 
 # Fix Python2/Python3 incompatibility
 try: input = raw_input
@@ -9,8 +19,39 @@ except NameError: pass
 
 log = logging.getLogger(__name__)
 
+# Default script for each engine module
+SCRIPTS = {
+    'eliza': 'doctor.txt',
+    'my_eliza': 'my_doctor.txt',
+}
+
+# Bump when the compiled layout changes so old script caches are ignored
+CACHE_VERSION = 8
+
+# Default number of items a session remembers before evicting the oldest
+MEMORY_SIZE = 32
+
+# Leads every session snapshot; the last byte is the format version
+SNAPSHOT_MAGIC = b'ESS\x01'
+
+# A run of '.', ',' or ';' is one token; anything else splits on whitespace.
+# _tokenize() collapses punctuation runs to a single character.
+TOKEN_RE = re.compile(r'\.+|,+|;+|[^\s.,;]+')
+
+# Words that end a capture inserted into a reassembly
+PUNCTUATION = frozenset([',', '.', ';'])
+
+# Marks a missing entry in caches whose values may be None
+_MISSING = object()
+
+# Session-independent result of preparing one input for respond()
+# script is the Script the turn was prepared with
+Turn = namedtuple('Turn', ['words', 'lowered', 'keys', 'possible', 'script'])
+
 
 class Key:
+    __slots__ = ('word', 'weight', 'decomps')
+
     def __init__(self, word, weight, decomps):
         self.word = word
         self.weight = weight
@@ -18,14 +59,334 @@ class Key:
 
 
 class Decomp:
+    __slots__ = ('parts', 'save', 'reasmbs', 'index', 'matcher', 'templates',
+                 'gotos')
+
     def __init__(self, parts, save, reasmbs):
         self.parts = parts
         self.save = save
         self.reasmbs = reasmbs
-        self.next_reasmb_index = 0
+        self.index = None
+        self.matcher = None
+        self.templates = None
+        self.gotos = None   # per reassembly, the Key it goes to or None
 
 
-class Eliza:
+def compile_template(reasmb):
+    """Split a reassembly into runs of literal words and capture slots.
+
+    Returns a tuple whose items are either a tuple of words to output as is
+    or the 0-based index of the capture to insert, so '(2)' is parsed once.
+    """
+    template = []
+    run = []
+    for reword in reasmb:
+        if not reword:
+            continue
+        if reword[0] == '(' and reword[-1] == ')':
+            if run:
+                template.append(tuple(run))
+                run = []
+            template.append(int(reword[1:-1]) - 1)
+        else:
+            run.append(reword)
+    if run:
+        template.append(tuple(run))
+    return tuple(template)
+
+
+class Matcher:
+    """Compiled decomposition pattern.
+
+    The parts are split on '*' into fixed-width segments of literals and
+    '@synon' sets. A '*' always takes the longest capture that still lets the
+    rest of the pattern match, so placing each segment as far right as
+    possible, from the last one back to the first, gives the same captures as
+    trying every split recursively, in time linear in the input length.
+    """
+
+    __slots__ = ('parts', 'requirements', 'segments', 'captures')
+
+    def __init__(self, parts, synons):
+        self.parts = parts
+        self.requirements = set()
+        # one capture per '*' and per '@synon'
+        self.captures = 0
+        segments = [[]]
+        for part in parts:
+            if part == '*':
+                segments.append([])
+                self.captures += 1
+            elif part.startswith('@'):
+                root = part[1:]
+                if not root in synons:
+                    raise ValueError("Unknown synonym root {}".format(root))
+                # frozenset() returns a frozenset argument itself, so
+                # compiled synonym sets are shared rather than copied
+                group = frozenset(synons[root])
+                segments[-1].append(group)
+                self.captures += 1
+                self.requirements.add(group)
+            else:
+                segments[-1].append(part.lower())
+                self.requirements.add(frozenset([part.lower()]))
+        self.segments = [tuple(segment) for segment in segments]
+
+    @staticmethod
+    def _matches_at(segment, lowered, start):
+        for offset, test in enumerate(segment):
+            word = lowered[start + offset]
+            if isinstance(test, str):
+                if test != word:
+                    return False
+            elif not word in test:
+                return False
+        return True
+
+    def _place(self, lowered):
+        head = self.segments[0]
+        if len(self.segments) == 1:
+            if len(lowered) != len(head) or not self._matches_at(head, lowered, 0):
+                return None
+            return [0]
+        tail = self.segments[-1]
+        end = len(lowered) - len(tail)
+        if end < len(head):
+            return None
+        if not self._matches_at(head, lowered, 0):
+            return None
+        if not self._matches_at(tail, lowered, end):
+            return None
+        starts = [end]
+        for segment in reversed(self.segments[1:-1]):
+            start = end - len(segment)
+            while start >= len(head) and not self._matches_at(segment, lowered, start):
+                start -= 1
+            if start < len(head):
+                return None
+            starts.append(start)
+            end = start
+        starts.append(0)
+        starts.reverse()
+        return starts
+
+    def spans(self, lowered):
+        """Return the (start, end) index span of each capture, or None."""
+        starts = self._place(lowered)
+        if starts is None:
+            return None
+        spans = []
+        end = 0
+        for index, (segment, start) in enumerate(zip(self.segments, starts)):
+            if index:
+                spans.append((end, start))
+            for offset, test in enumerate(segment):
+                if not isinstance(test, str):
+                    spans.append((start + offset, start + offset + 1))
+            end = start + len(segment)
+        return spans
+
+    def match(self, words, lowered=None):
+        if lowered is None:
+            lowered = [w.lower() for w in words]
+        spans = self.spans(lowered)
+        if spans is None:
+            return None
+        return [words[start:end] for start, end in spans]
+
+
+class LRUCache:
+    """Bounded mapping that drops the least recently used entry when full."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # NLP stages may share a cache from pool threads
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def stats(self):
+        return {'size': len(self.data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+
+def _sizeof(item):
+    if isinstance(item, tuple):
+        return sys.getsizeof(item) + sum(sys.getsizeof(i) for i in item)
+    return sys.getsizeof(item)
+
+
+class Memory:
+    """Bounded set of remembered items with O(1) random removal.
+
+    Items must be hashable. Adding an item that is already remembered
+    refreshes it instead of storing a duplicate; once capacity is exceeded
+    the least recently added item is evicted. Iteration is oldest first.
+    """
+
+    def __init__(self, capacity=MEMORY_SIZE):
+        self.capacity = capacity
+        self.items = []             # dense, for random sampling
+        self.positions = {}         # item -> index in items
+        self.order = OrderedDict()  # items by recency, oldest first
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def add(self, item):
+        if item in self.positions:
+            self.order.move_to_end(item)
+            return
+        self.positions[item] = len(self.items)
+        self.items.append(item)
+        self.order[item] = None
+        if len(self.items) > self.capacity:
+            evicted = next(iter(self.order))
+            self.remove(evicted)
+            log.debug('Evicted from memory: %s', evicted)
+
+    def remove(self, item):
+        # move the last item into the hole so removal stays O(1)
+        index = self.positions.pop(item)
+        last = self.items.pop()
+        if index < len(self.items):
+            self.items[index] = last
+            self.positions[last] = index
+        del self.order[item]
+
+    def pop_random(self):
+        item = self.items[random.randrange(len(self.items))]
+        self.remove(item)
+        return item
+
+    def footprint(self):
+        """Approximate bytes held by the memory and its items."""
+        return (sys.getsizeof(self.items) + sys.getsizeof(self.positions) +
+                sys.getsizeof(self.order) +
+                sum(_sizeof(item) for item in self.items))
+
+
+class Session:
+    """State of one conversation.
+
+    Holds everything respond() changes, so a single loaded Eliza can serve
+    any number of conversations. Reassembly rotation is keyed by Decomp.index.
+    """
+
+    def __init__(self, id=None, memory_size=MEMORY_SIZE):
+        self.id = id if id is not None else uuid.uuid4().hex
+        self.reasmb_indices = {}
+        self.memory = Memory(memory_size)
+        # version of the engine's script that reasmb_indices refers to
+        self.script_version = 0
+
+    def footprint(self):
+        """Approximate bytes held by this session's state."""
+        return (sys.getsizeof(self) + sys.getsizeof(self.__dict__) +
+                sys.getsizeof(self.id) + sys.getsizeof(self.reasmb_indices) +
+                self.memory.footprint())
+
+    def state(self):
+        """Return the session as a tuple of plain values, for snapshots."""
+        return (self.id, self.reasmb_indices, self.memory.capacity,
+                tuple(self.memory))
+
+    def restore(self, state):
+        self.id, self.reasmb_indices, capacity, items = state
+        self.memory = Memory(capacity)
+        for item in items:
+            self.memory.add(item)
+
+
+class ScriptWatcher:
+    """Polls a script file and hands each new compiled version to a callback.
+
+    The script is compiled on the watcher's thread, so responses are not
+    held up while it loads. A script that fails to load is logged and the
+    callback is not called.
+    """
+
+    def __init__(self, path, compile, callback, interval=1.0):
+        self.path = path
+        self.compile = compile
+        self.callback = callback
+        self.interval = interval
+        self.stamp = self._stamp()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        """Reload the script if it changed; return whether it was reloaded."""
+        stamp = self._stamp()
+        if stamp is None or stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        try:
+            state = self.compile(self.path)
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            log.error('Not reloading script %s: %s', self.path, e)
+            return False
+        except Exception:
+            # logged rather than raised, which would end the watcher thread
+            log.exception('Not reloading script %s', self.path)
+            return False
+        self.callback(state)
+        return True
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Script:
+    """A parsed and compiled script.
+
+    A Script is never changed once compiled. load() and swap_script() build
+    a new one and replace the engine's reference to it, so a turn that
+    reads engine.script once sees a single version throughout, even while
+    another thread swaps in the next.
+    """
+
     def __init__(self):
         self.initials = []
         self.finals = []
@@ -34,182 +395,690 @@ class Eliza:
         self.posts = {}
         self.synons = {}
         self.keys = {}
-        self.memory = []
+        self.decomps = []
+        self.decomp_index = {}
+        self.requirement_decomps = []
+        self.pre_table = {}
+        self.post_table = {}
+        self.digest = None      # identifies the script in session snapshots
+        self.version = 0        # position in the engine's swap history
 
-    def load(self, path):
+    def parse(self, lines):
         key = None
         decomp = None
-        with open(path) as file:
-            for line in file:
-                if not line.strip():
-                    continue
-                tag, content = [part.strip() for part in line.split(':')]
-                if tag == 'initial':
-                    self.initials.append(content)
-                elif tag == 'final':
-                    self.finals.append(content)
-                elif tag == 'quit':
-                    self.quits.append(content)
-                elif tag == 'pre':
-                    parts = content.split(' ')
-                    self.pres[parts[0]] = parts[1:]
-                elif tag == 'post':
-                    parts = content.split(' ')
-                    self.posts[parts[0]] = parts[1:]
-                elif tag == 'synon':
-                    parts = content.split(' ')
-                    self.synons[parts[0]] = parts
-                elif tag == 'key':
-                    parts = content.split(' ')
-                    word = parts[0]
-                    weight = int(parts[1]) if len(parts) > 1 else 1
-                    key = Key(word, weight, [])
-                    self.keys[word] = key
-                elif tag == 'decomp':
-                    parts = content.split(' ')
-                    save = False
-                    if parts[0] == '$':
-                        save = True
-                        parts = parts[1:]
-                    decomp = Decomp(parts, save, [])
-                    key.decomps.append(decomp)
-                elif tag == 'reasmb':
-                    parts = content.split(' ')
-                    decomp.reasmbs.append(parts)
-
-    def _match_decomp_r(self, parts, words, results):
-        if not parts and not words:
-            return True
-        if not parts or (not words and parts != ['*']):
-            return False
-        if parts[0] == '*':
-            for index in range(len(words), -1, -1):
-                results.append(words[:index])
-                if self._match_decomp_r(parts[1:], words[index:], results):
-                    return True
-                results.pop()
-            return False
-        elif parts[0].startswith('@'):
-            root = parts[0][1:]
-            if not root in self.synons:
-                raise ValueError("Unknown synonym root {}".format(root))
-            if not words[0].lower() in self.synons[root]:
-                return False
-            results.append([words[0]])
-            return self._match_decomp_r(parts[1:], words[1:], results)
-        elif parts[0].lower() != words[0].lower():
-            return False
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if ':' not in line:
+                raise ValueError("Invalid script line {}: {}".format(number, line))
+            tag, content = [part.strip() for part in line.split(':', 1)]
+            if tag == 'initial':
+                self.initials.append(content)
+            elif tag == 'final':
+                self.finals.append(content)
+            elif tag == 'quit':
+                self.quits.append(content)
+            elif tag == 'pre':
+                parts = content.split(' ')
+                self.pres[parts[0]] = parts[1:]
+            elif tag == 'post':
+                parts = content.split(' ')
+                self.posts[parts[0]] = parts[1:]
+            elif tag == 'synon':
+                parts = content.split(' ')
+                self.synons[parts[0]] = parts
+            elif tag == 'key':
+                parts = content.split(' ')
+                word = parts[0]
+                weight = int(parts[1]) if len(parts) > 1 else 1
+                key = Key(word, weight, [])
+                self.keys[word] = key
+            elif tag == 'decomp':
+                if key is None:
+                    raise ValueError("Decomp outside a key on line {}".format(number))
+                parts = content.split(' ')
+                save = False
+                if parts[0] == '$':
+                    save = True
+                    parts = parts[1:]
+                decomp = Decomp(parts, save, [])
+                decomp.index = len(self.decomps)
+                self.decomps.append(decomp)
+                key.decomps.append(decomp)
+            elif tag == 'reasmb':
+                if decomp is None:
+                    raise ValueError("Reasmb outside a decomp on line {}".format(number))
+                parts = content.split(' ')
+                decomp.reasmbs.append(parts)
+            else:
+                raise ValueError("Unknown tag {} on line {}".format(tag, number))
+
+    def state(self):
+        """Return the compiled script as plain data for the script cache.
+
+        Only strings, numbers, tuples, lists and dicts are used, so a cache
+        written by `python eliza.py` loads in any module that imports eliza.
+        """
+        return {
+            'initials': self.initials,
+            'finals': self.finals,
+            'quits': self.quits,
+            'pres': self.pres,
+            'posts': self.posts,
+            'synons': dict((root, tuple(sorted(words)))
+                           for root, words in self.synons.items()),
+            'keys': [(key.word, key.weight,
+                      tuple(decomp.index for decomp in key.decomps))
+                     for key in self.keys.values()],
+            'decomps': [(decomp.parts, decomp.save, decomp.reasmbs,
+                         decomp.templates,
+                         tuple(None if goto is None else goto.word
+                               for goto in decomp.gotos))
+                        for decomp in self.decomps],
+            'digest': self.digest,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a Script from state(), without validating it again."""
+        script = cls()
+        for name in ('initials', 'finals', 'quits', 'pres', 'posts', 'digest'):
+            setattr(script, name, state[name])
+        script.synons = dict((root, frozenset(words))
+                             for root, words in state['synons'].items())
+        for parts, save, reasmbs, templates, gotos in state['decomps']:
+            decomp = Decomp(parts, save, reasmbs)
+            decomp.index = len(script.decomps)
+            decomp.templates = templates
+            decomp.matcher = Matcher(parts, script.synons)
+            decomp.gotos = gotos    # key words until the keys exist
+            script.decomps.append(decomp)
+        for word, weight, indices in state['keys']:
+            script.keys[word] = Key(word, weight,
+                                    tuple(script.decomps[i] for i in indices))
+        for decomp in script.decomps:
+            decomp.gotos = tuple(None if goto is None else script.keys[goto]
+                                 for goto in decomp.gotos)
+        script._index_decomps()
+        script.pre_table = script._compile_subs(script.pres)
+        script.post_table = script._compile_subs(script.posts)
+        return script
+
+    def compile(self):
+        # Freeze the parsed script into tuples of interned words, which
+        # take less memory than lists of separate strings.
+        intern = sys.intern
+        self.synons = dict((root, frozenset(intern(w) for w in words))
+                           for root, words in self.synons.items())
+        for key in self.keys.values():
+            key.decomps = tuple(key.decomps)
+        for decomp in self.decomps:
+            decomp.parts = tuple(intern(part) for part in decomp.parts)
+            decomp.reasmbs = tuple(tuple(intern(w) for w in reasmb)
+                                   for reasmb in decomp.reasmbs)
+            decomp.templates = tuple(compile_template(reasmb)
+                                     for reasmb in decomp.reasmbs)
+            decomp.matcher = Matcher(decomp.parts, self.synons)
+        self._link_decomps()
+        self._index_decomps()
+        self.pre_table = self._compile_subs(self.pres)
+        self.post_table = self._compile_subs(self.posts)
+
+    def _link_decomps(self):
+        # Resolves every goto to its Key and checks every capture index, so
+        # a bad script fails here rather than on the turn that reaches it.
+        for key in self.keys.values():
+            for decomp in key.decomps:
+                where = "key {} decomp {}".format(key.word, ' '.join(decomp.parts))
+                if not decomp.reasmbs:
+                    raise ValueError("No reassembly for {}".format(where))
+                gotos = []
+                for reasmb, template in zip(decomp.reasmbs, decomp.templates):
+                    if reasmb[0] == 'goto':
+                        if len(reasmb) != 2 or reasmb[1] not in self.keys:
+                            raise ValueError("Invalid goto key {} in {}".format(
+                                ' '.join(reasmb[1:]), where))
+                        gotos.append(self.keys[reasmb[1]])
+                        continue
+                    gotos.append(None)
+                    for part in template:
+                        if (isinstance(part, int) and
+                                not 0 <= part < decomp.matcher.captures):
+                            raise ValueError("Invalid result index {} in {}".format(
+                                part + 1, where))
+                decomp.gotos = tuple(gotos)
+        if 'xnone' not in self.keys:
+            raise ValueError("Script has no xnone key")
+        self._check_goto_cycles()
+
+    def _check_goto_cycles(self):
+        targets = dict((word, sorted(set(goto.word for decomp in key.decomps
+                                         for goto in decomp.gotos if goto)))
+                       for word, key in self.keys.items())
+        done = set()
+        for start in sorted(targets):
+            # depth-first walk; reaching a key that is still on the path
+            # closes a cycle
+            path = [start]
+            pending = [iter(targets[start])]
+            while pending:
+                word = next(pending[-1], None)
+                if word is None:
+                    done.add(path.pop())
+                    pending.pop()
+                elif word in path:
+                    cycle = path[path.index(word):] + [word]
+                    raise ValueError("Goto cycle {}".format(' -> '.join(cycle)))
+                elif word not in done:
+                    path.append(word)
+                    pending.append(iter(targets[word]))
+
+    def _compile_subs(self, subs):
+        # word -> (replacement words, their lowercase forms), so substituting
+        # never lowercases a word twice
+        return dict((word.lower(), (list(values), [v.lower() for v in values]))
+                    for word, values in subs.items())
+
+    def _index_decomps(self):
+        # Maps each word to the decomp requirements (a literal or a synonym
+        # group) it satisfies, so respond() can tell which decomps might match
+        # without running their matchers.
+        self.decomp_index = {}
+        self.requirement_decomps = []
+        for decomp in self.decomps:
+            for requirement in decomp.matcher.requirements:
+                for word in requirement:
+                    self.decomp_index.setdefault(word, []).append(
+                        len(self.requirement_decomps))
+                self.requirement_decomps.append(decomp)
+
+
+class Eliza:
+    session_class = Session
+
+    # Methods timed by instrument(), and the stage each is recorded as
+    STAGES = {
+        '_prepare': 'prepare',
+        '_tokenize': 'tokenize',
+        '_sorted_keys': 'sort_keys',
+        '_possible_decomps': 'decomp_index',
+        '_respond_turn': 'respond',
+        '_match_key': 'match_key',
+        '_goto': 'goto',
+        '_recall': 'memory',
+        '_xnone': 'xnone',
+    }
+
+    def __init__(self, memory_size=MEMORY_SIZE, response_cache_size=0):
+        self.memory_size = memory_size
+        # memoized decomp matches and reassemblies, off when the size is 0
+        self.response_cache = (LRUCache(response_cache_size)
+                               if response_cache_size else None)
+        self.script = Script()
+        self.metrics = None
+        # script_remaps[v] maps the decomp indices of script version v to
+        # those of version v + 1
+        self.script_remaps = []
+        self.session = self.new_session()
+
+    @property
+    def memory(self):
+        return self.session.memory
+
+    @property
+    def keys(self):
+        return self.script.keys
+
+    @property
+    def script_version(self):
+        return self.script.version
+
+    def new_session(self, id=None):
+        session = self.session_class(id, self.memory_size)
+        session.script_version = self.script.version
+        return session
+
+    def instrument(self, metrics):
+        """Record the count and latency of each stage in STAGES in metrics."""
+        if self.metrics is not None:
+            raise ValueError('Engine is already instrumented')
+        for method, stage in self.STAGES.items():
+            setattr(self, method, metrics.wrap(stage, getattr(self, method)))
+        self.metrics = metrics
+
+    def load(self, path, cache=True):
+        """Load a script, reusing its compiled cache when it is up to date.
+
+        The cache is written next to the script as <path>.cache and is keyed
+        by a hash of the script, so edits to the script invalidate it.
+        """
+        with open(path, 'rb') as file:
+            data = file.read()
+        digest = (CACHE_VERSION, hashlib.sha256(data).hexdigest())
+        cache_path = path + '.cache'
+        script = self._load_cache(cache_path, digest) if cache else None
+        if script is None:
+            script = Script()
+            script.parse(data.decode('utf-8').splitlines())
+            script.compile()
+            script.digest = bytes.fromhex(digest[1][:16])
+            if cache:
+                self._save_cache(cache_path, digest, script)
+        script.version = self.script.version
+        if self.response_cache is not None:
+            self.response_cache.data.clear()
+        self.script = script
+
+    def compile_script(self, path):
+        """Load the script at path without touching this engine.
+
+        Returns the Script for swap_script().
+        """
+        engine = Eliza()
+        engine.load(path)
+        return engine.script
+
+    def swap_script(self, script):
+        """Switch to a script compiled by compile_script().
+
+        Safe to call from any thread: turns already running finish on the
+        script they started with. Sessions keep their memory, and the
+        reassembly rotation of each decomp that is still in the new script
+        under the same key. Each session is brought up to date on its next
+        turn.
+        """
+        current = self.script
+        remap = {}
+        new_ids = self._decomp_identities(script.keys)
+        for identity, index in self._decomp_identities(current.keys).items():
+            if identity in new_ids:
+                remap[index] = new_ids[identity]
+        # a copy, as the script passed in may already be in use elsewhere
+        script = copy.copy(script)
+        script.version = current.version + 1
+        # the remap is in place before any turn can see the new version
+        self.script_remaps.append(remap)
+        if self.response_cache is not None:
+            self.response_cache = LRUCache(self.response_cache.maxsize)
+        self.script = script
+        log.info('Switched to script version %d, kept %d decomps',
+                 script.version, len(remap))
+
+    def _decomp_identities(self, keys):
+        # A decomp is the same across versions if its key word, pattern and
+        # save flag match; repeats are told apart by their order in the key.
+        identities = {}
+        for key in keys.values():
+            for decomp in key.decomps:
+                identity = (key.word, tuple(decomp.parts), decomp.save)
+                n = 0
+                while identity + (n,) in identities:
+                    n += 1
+                identities[identity + (n,)] = decomp.index
+        return identities
+
+    def _sync_session(self, session, script=None):
+        if script is None:
+            script = self.script
+        while session.script_version < script.version:
+            remap = self.script_remaps[session.script_version]
+            session.reasmb_indices = dict(
+                (remap[index], count)
+                for index, count in session.reasmb_indices.items()
+                if index in remap)
+            session.script_version += 1
+
+    def dump_session(self, session):
+        """Return a compact binary snapshot of session.
+
+        The snapshot holds the session's memory and reassembly rotation,
+        tagged with a digest of the script the rotation refers to.
+        """
+        script = self.script
+        self._sync_session(session, script)
+        return SNAPSHOT_MAGIC + marshal.dumps((script.digest, session.state()))
+
+    def load_session(self, data):
+        """Return the Session saved by dump_session().
+
+        If the snapshot was taken under a different script, the rotation is
+        dropped and the memory kept.
+        """
+        if not data.startswith(SNAPSHOT_MAGIC):
+            raise ValueError("Not a session snapshot")
+        try:
+            digest, state = marshal.loads(data[len(SNAPSHOT_MAGIC):])
+            session = self.new_session()
+            session.restore(state)
+        except (EOFError, TypeError, ValueError) as e:
+            raise ValueError("Corrupt session snapshot: {}".format(e))
+        if digest != self.script.digest:
+            session.reasmb_indices = {}
+        return session
+
+    def watch(self, path, interval=1.0, schedule=None):
+        """Reload the script at path whenever it changes.
+
+        schedule(func, script) runs the swap, e.g. loop.call_soon_threadsafe
+        so an asyncio server switches scripts between turns; by default the
+        swap happens on the watcher thread, which swap_script() allows.
+        Returns the ScriptWatcher.
+        """
+        if schedule is None:
+            callback = self.swap_script
         else:
-            return self._match_decomp_r(parts[1:], words[1:], results)
+            callback = lambda script: schedule(self.swap_script, script)
+        return ScriptWatcher(path, self.compile_script, callback, interval)
+
+    def _load_cache(self, cache_path, digest):
+        # Returns the cached Script, or None if there is no usable cache.
+        # Any cache that cannot be read is a miss and the script is parsed
+        # again, whatever the error. The cache is marshal data, not a
+        # pickle, so a planted cache file cannot run code when loaded.
+        try:
+            with open(cache_path, 'rb') as file:
+                cached = marshal.load(file)
+            if not isinstance(cached, dict) or cached.get('digest') != digest:
+                log.debug('Script cache %s is stale', cache_path)
+                return None
+            return Script.from_state(cached['script'])
+        except Exception as e:
+            log.debug('No usable script cache %s: %s', cache_path, e)
+            return None
+
+    def _save_cache(self, cache_path, digest, script):
+        tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as file:
+                marshal.dump({'digest': digest, 'script': script.state()}, file)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            log.debug('Could not write script cache %s: %s', cache_path, e)
+
+    def _possible_decomps(self, lowered, script=None):
+        if script is None:
+            script = self.script
+        satisfied = set()
+        for word in set(lowered):
+            satisfied.update(script.decomp_index.get(word, ()))
+        counts = {}
+        for requirement in satisfied:
+            decomp = script.requirement_decomps[requirement]
+            counts[decomp] = counts.get(decomp, 0) + 1
+        return counts
 
     def _match_decomp(self, parts, words):
-        results = []
-        if self._match_decomp_r(parts, words, results):
-            return results
-        return None
+        return Matcher(parts, self.script.synons).match(words)
+
+    def _next_reasmb_index(self, decomp, session=None):
+        if session is None:
+            session = self.session
+        index = session.reasmb_indices.get(decomp.index, 0)
+        session.reasmb_indices[decomp.index] = index + 1
+        return index % len(decomp.reasmbs)
 
-    def _next_reasmb(self, decomp):
-        index = decomp.next_reasmb_index
-        result = decomp.reasmbs[index % len(decomp.reasmbs)]
-        decomp.next_reasmb_index = index + 1
-        return result
+    def _next_reasmb(self, decomp, session=None):
+        return decomp.reasmbs[self._next_reasmb_index(decomp, session)]
+
+    def _decomp_results(self, decomp, words, lowered, tokens=None,
+                        script=None):
+        """Return the post-substituted captures of decomp, or None.
+
+        tokens is tuple(words) when the response cache is on; the result
+        for each (tokens, decomp) pair is then computed once. Entries are
+        keyed by the Decomp itself, so a turn still running on a swapped
+        out script never fills in entries for the new one.
+        """
+        if script is None:
+            script = self.script
+        if tokens is not None:
+            results = self.response_cache.get((tokens, decomp), _MISSING)
+            if results is not _MISSING:
+                return results
+        spans = decomp.matcher.spans(lowered)
+        if spans is None:
+            results = None
+        else:
+            results = [self._substitute(words[start:end], lowered[start:end],
+                                        script.post_table)
+                       for start, end in spans]
+        if tokens is not None:
+            self.response_cache.put((tokens, decomp), results)
+        return results
+
+    def _reassemble_decomp(self, decomp, index, results, tokens=None):
+        # A Decomp belongs to one key, so (tokens, decomp, reassembly)
+        # identifies the output without the key.
+        if tokens is None:
+            return self._reassemble(decomp.templates[index], results)
+        cache_key = (tokens, decomp, index)
+        output = self.response_cache.get(cache_key)
+        if output is None:
+            output = tuple(self._reassemble(decomp.templates[index], results))
+            self.response_cache.put(cache_key, output)
+        return output
 
-    def _reassemble(self, reasmb, results):
+    def _reassemble(self, template, results):
         output = []
-        for reword in reasmb:
-            if not reword:
-                continue
-            if reword[0] == '(' and reword[-1] == ')':
-                index = int(reword[1:-1])
-                if index < 1 or index > len(results):
-                    raise ValueError("Invalid result index {}".format(index))
-                insert = results[index - 1]
-                for punct in [',', '.', ';']:
-                    if punct in insert:
-                        insert = insert[:insert.index(punct)]
+        for part in template:
+            if isinstance(part, int):
+                insert = results[part]
+                # a capture is cut at its first punctuation mark
+                for end, word in enumerate(insert):
+                    if word in PUNCTUATION:
+                        insert = insert[:end]
+                        break
                 output.extend(insert)
             else:
-                output.append(reword)
+                output.extend(part)
         return output
 
-    def _sub(self, words, sub):
+    def _substitute(self, words, lowered, table):
         output = []
-        for word in words:
-            word_lower = word.lower()
-            if word_lower in sub:
-                output.extend(sub[word_lower])
-            else:
+        for word, word_lower in zip(words, lowered):
+            sub = table.get(word_lower)
+            if sub is None:
                 output.append(word)
+            else:
+                output.extend(sub[0])
         return output
 
-    def _match_key(self, words, key):
+    def _match_key(self, words, key, possible=None, session=None,
+                   lowered=None, script=None):
+        if session is None:
+            session = self.session
+        if lowered is None:
+            lowered = [w.lower() for w in words]
+        tokens = tuple(words) if self.response_cache is not None else None
         for decomp in key.decomps:
-            results = self._match_decomp(decomp.parts, words)
+            if (possible is not None and
+                    possible.get(decomp, 0) < len(decomp.matcher.requirements)):
+                continue
+            results = self._decomp_results(decomp, words, lowered, tokens,
+                                           script)
             if results is None:
                 log.debug('Decomp did not match: %s', decomp.parts)
                 continue
             log.debug('Decomp matched: %s', decomp.parts)
-            log.debug('Decomp results: %s', results)
-            results = [self._sub(words, self.posts) for words in results]
             log.debug('Decomp results after posts: %s', results)
-            reasmb = self._next_reasmb(decomp)
-            log.debug('Using reassembly: %s', reasmb)
-            if reasmb[0] == 'goto':
-                goto_key = reasmb[1]
-                if not goto_key in self.keys:
-                    raise ValueError("Invalid goto key {}".format(goto_key))
-                log.debug('Goto key: %s', goto_key)
-                return self._match_key(words, self.keys[goto_key])
-            output = self._reassemble(reasmb, results)
+            index = self._next_reasmb_index(decomp, session)
+            log.debug('Using reassembly: %s', decomp.reasmbs[index])
+            goto = decomp.gotos[index]
+            if goto is not None:
+                return self._goto(goto, words, possible, session, lowered,
+                                  script)
+            output = self._reassemble_decomp(decomp, index, results, tokens)
             if decomp.save:
-                self.memory.append(output)
-                log.debug('Saved to memory: %s', output)
-                continue
+                output = self._save(decomp, words, output, session)
+                if output is None:
+                    continue
             return output
         return None
 
-    def respond(self, text):
-        if text.lower() in self.quits:
-            return None
+    def _save(self, decomp, words, output, session):
+        # Remembers the output of a '$' decomposition for a later turn.
+        # Returns the reply for this turn, or None to go on matching.
+        session.memory.add(tuple(output))
+        log.debug('Saved to memory: %s', output)
+        return None
+
+    def _goto(self, key, words, possible, session, lowered, script=None):
+        log.debug('Goto key: %s', key.word)
+        return self._match_key(words, key, possible, session, lowered, script)
+
+    def _recall(self, session):
+        output = session.memory.pop_random()
+        log.debug('Output from memory: %s', output)
+        return output
+
+    def _xnone(self, session, script=None):
+        if script is None:
+            script = self.script
+        output = self._next_reasmb(script.keys['xnone'].decomps[0], session)
+        log.debug('Output from xnone: %s', output)
+        return output
+
+    def _tokenize(self, text, script=None):
+        """Split text into words and apply pre-substitutions in one pass.
+
+        Returns the tokens as typed, the substituted words and the lowercase
+        form of each substituted word.
+        """
+        if script is None:
+            script = self.script
+        tokens = []
+        words = []
+        lowered = []
+        pres = script.pre_table
+        for token in TOKEN_RE.findall(text):
+            if token[0] in '.,;':
+                token = token[0]
+            tokens.append(token)
+            token_lower = token.lower()
+            sub = pres.get(token_lower)
+            if sub is None:
+                words.append(token)
+                lowered.append(token_lower)
+            else:
+                words.extend(sub[0])
+                lowered.extend(sub[1])
+        return tokens, words, lowered
 
-        text = re.sub(r'\s*\.+\s*', ' . ', text)
-        text = re.sub(r'\s*,+\s*', ' , ', text)
-        text = re.sub(r'\s*;+\s*', ' ; ', text)
-        log.debug('After punctuation cleanup: %s', text)
+    def _sorted_keys(self, lowered, script=None):
+        if script is None:
+            script = self.script
+        keys = [script.keys[w] for w in lowered if w in script.keys]
+        return sorted(keys, key=lambda k: -k.weight)
 
-        words = [w for w in text.split(' ') if w]
-        log.debug('Input: %s', words)
+    def _prepare(self, text, script=None):
+        # The stages of respond() that do not depend on the session, so
+        # respond_many() can run them once per distinct text.
+        if script is None:
+            script = self.script
+        if text.lower() in script.quits:
+            return None
 
-        words = self._sub(words, self.pres)
+        tokens, words, lowered = self._tokenize(text, script)
         log.debug('After pre-substitution: %s', words)
 
-        keys = [self.keys[w.lower()] for w in words if w.lower() in self.keys]
-        keys = sorted(keys, key=lambda k: -k.weight)
-        log.debug('Sorted keys: %s', [(k.word, k.weight) for k in keys])
+        keys = self._sorted_keys(lowered, script)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Sorted keys: %s', [(k.word, k.weight) for k in keys])
+
+        return Turn(words, lowered, keys,
+                    self._possible_decomps(lowered, script), script)
+
+    def _prepare_many(self, texts, script=None):
+        return dict((text, self._prepare(text, script=script))
+                    for text in set(texts))
+
+    def _respond_turn(self, turn, session):
+        if turn is None:
+            return None
 
         output = None
 
-        for key in keys:
-            output = self._match_key(words, key)
+        for key in turn.keys:
+            output = self._match_key(turn.words, key, turn.possible, session,
+                                     turn.lowered, turn.script)
             if output:
                 log.debug('Output from key: %s', output)
                 break
         if not output:
-            if self.memory:
-                index = random.randrange(len(self.memory))
-                output = self.memory.pop(index)
-                log.debug('Output from memory: %s', output)
+            if session.memory:
+                output = self._recall(session)
             else:
-                output = self._next_reasmb(self.keys['xnone'].decomps[0])
-                log.debug('Output from xnone: %s', output)
+                output = self._xnone(session, turn.script)
 
         return " ".join(output)
 
+    def respond(self, text, session=None):
+        if session is None:
+            session = self.session
+        # read once, so the whole turn runs on one version of the script
+        script = self.script
+        self._sync_session(session, script)
+        return self._respond_turn(self._prepare(text, script=script), session)
+
+    async def respond_async(self, text, session=None):
+        """respond() for asyncio callers; engines with slow stages override
+        this to run them off the event loop."""
+        return self.respond(text, session)
+
+    def respond_many(self, texts, sessions=None, chunk_size=1024):
+        """Respond to each text in turn, exactly as repeated respond() calls.
+
+        sessions gives one session per text, or None to use the default
+        session for all of them. Within each chunk the session-independent
+        stages run once per distinct text.
+        """
+        texts = list(texts)
+        if sessions is None:
+            sessions = [self.session] * len(texts)
+        else:
+            sessions = list(sessions)
+            if len(sessions) != len(texts):
+                raise ValueError("Got {} texts but {} sessions".format(
+                    len(texts), len(sessions)))
+        outputs = []
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            script = self.script
+            turns = self._prepare_many(chunk, script)
+            for text, session in zip(chunk, sessions[start:start + chunk_size]):
+                self._sync_session(session, script)
+                outputs.append(self._respond_turn(turns[text], session))
+        return outputs
+
     def initial(self):
-        return random.choice(self.initials)
+        return random.choice(self.script.initials)
 
     def final(self):
-        return random.choice(self.finals)
+        return random.choice(self.script.finals)
+
+    def stream(self, utterances):
+        """Yield a response record for each (session id, text) in utterances.
+
+        Sessions are created on their first utterance and dropped after a
+        quit word, whose record has event 'quit' and the closing line.
+        """
+        sessions = {}
+        for session_id, text in utterances:
+            session = sessions.get(session_id)
+            if session is None:
+                session = sessions[session_id] = self.new_session(session_id)
+            record = self._stream_turn(text, session)
+            if record.get('event') == 'quit':
+                del sessions[session_id]
+            yield record
+
+    def _stream_turn(self, text, session):
+        output = self.respond(text, session)
+        if output is None:
+            return {'session': session.id, 'event': 'quit',
+                    'response': self.final()}
+        return {'session': session.id, 'response': output}
 
     def run(self):
         print(self.initial())
@@ -226,10 +1095,87 @@ class Eliza:
         print(self.final())
 
 
-def main():
-    eliza = Eliza()
-    eliza.load('doctor.txt')
-    eliza.run()
+def load_engine(name='eliza', script=None, crisis_report_path=_MISSING,
+                **options):
+    """Create the Eliza of the named engine module and load its script.
+
+    options are passed to the engine's Eliza(). crisis_report_path is set
+    only on engines that write crisis reports; None turns them off.
+    """
+    module = importlib.import_module(name)
+    engine = module.Eliza(**options)
+    if (crisis_report_path is not _MISSING and
+            hasattr(engine, 'crisis_report_path')):
+        engine.crisis_report_path = crisis_report_path
+    engine.load(script or SCRIPTS[name])
+    return engine
+
+
+def read_utterances(file, jsonl=False):
+    """Yield (session id, text) for each utterance in file.
+
+    Plain lines all belong to one session, whose id is None. JSONL lines
+    are objects with a "text" and an optional "session".
+    """
+    for number, line in enumerate(file, 1):
+        if not jsonl:
+            yield None, line.rstrip('\r\n')
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            yield record.get('session'), record['text']
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError("Invalid utterance on line {}: {}".format(number, e))
+
+
+def write_records(records, file, jsonl=False, batch=256):
+    """Write response records to file, flushing every batch records.
+
+    Plain output has one line per record, so multi-line responses are
+    joined into one line.
+    """
+    buffer = []
+    for record in records:
+        if jsonl:
+            buffer.append(json.dumps(record) + '\n')
+        else:
+            buffer.append(' '.join(record['response'].splitlines()) + '\n')
+        if len(buffer) >= batch:
+            file.write(''.join(buffer))
+            file.flush()
+            buffer = []
+    file.write(''.join(buffer))
+    file.flush()
+
+
+def main(engine=None, script=SCRIPTS['eliza']):
+    parser = argparse.ArgumentParser(
+        description='Talk to Eliza, or stream utterances through it.')
+    parser.add_argument('--script', default=script)
+    parser.add_argument('--pipe', action='store_true',
+                        help='write one response per input line instead of chatting')
+    parser.add_argument('--jsonl', action='store_true',
+                        help='with --pipe, read {"session": ..., "text": ...} '
+                        'lines and write JSON records')
+    parser.add_argument('--batch', type=int, default=256,
+                        help='with --pipe, responses written per flush; use 1 '
+                        'when another program waits for each reply')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='with --pipe, file to read, or - for stdin')
+    args = parser.parse_args()
+
+    if engine is None:
+        engine = Eliza()
+    engine.load(args.script)
+    if not args.pipe:
+        engine.run()
+        return
+    infile = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    with infile:
+        records = engine.stream(read_utterances(infile, args.jsonl))
+        write_records(records, sys.stdout, args.jsonl, args.batch)
 
 if __name__ == '__main__':
     logging.basicConfig()
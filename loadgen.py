@@ -0,0 +1,355 @@
+"""Load generator simulating many concurrent conversations with Eliza.
+
+Synthetic conversations are drawn from templates that exercise the
+script's keys, goto chains, memory fallbacks and, in my_eliza.py, the
+crisis questionnaire. They run concurrently either against an engine in
+this process or against a running server.py over a local socket:
+
+    python loadgen.py --engine my_eliza --conversations 5000 --concurrency 1000
+    python loadgen.py --port 8023 --pid $(pgrep -f server.py)
+
+The report gives throughput, p50/p95/p99 latency per kind of turn, and the
+resident set size sampled over the run, so a leak shows up as RSS that
+keeps growing while the number of live sessions does not. In process, the
+samples also give the total Session.footprint() of the live sessions.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import os
+import random
+import time
+
+from eliza import SCRIPTS, load_engine
+
+log = logging.getLogger(__name__)
+
+FAMILY = ['mother', 'father', 'sister', 'brother', 'wife', 'dad']
+FEELINGS = ['sad', 'unhappy', 'depressed', 'stressed', 'happy', 'glad']
+THINGS = ['work', 'school', 'money', 'the future', 'my health', 'moving house']
+PLACES = ['work', 'school', 'home', 'the office', 'church']
+
+# One utterance each, matching a key of doctor.txt and my_doctor.txt
+KEYS = [
+    'I am {feeling} about {thing}.',
+    'I feel {feeling} when I think about {thing}.',
+    'I remember when my {family} took me to {place}.',
+    'Perhaps I should talk to someone about {thing}.',
+    'What do you think about {thing}?',
+    'Because I never have time for {thing}.',
+    'Can you help me with {thing}?',
+    'Hello, I am new here.',
+    'Do computers worry you?',
+    'My name is not important.',
+    'If only {thing} was easier.',
+    'You are not really listening.',
+    'Your questions are strange.',
+    'I always worry about {thing}.',
+    'Sorry, I lost my train of thought.',
+]
+
+# Keys whose reassembly rules go to another key
+GOTOS = [
+    'I apologise for being late.',
+    'Ich spreche nur deutsch.',
+    'I dreamed about {thing} last night.',
+    'Everybody at {place} ignores me.',
+    'Nobody understands me.',
+    'You are like my {family}.',
+    'Why can\'t I stop thinking about {thing}?',
+    'Are you a real doctor?',
+]
+
+# Saved to memory by the '$ * my *' decomposition...
+SAVES = [
+    'My {family} never listens to me.',
+    'My {family} is always busy with {thing}.',
+    'I think my {family} is {feeling}.',
+]
+
+# ...and brought back by an input without any key
+UNMATCHED = [
+    'It rained all day.',
+    'Not much else to say.',
+    'Hmm.',
+    'The bus took ages this morning.',
+    'Nothing new.',
+]
+
+CRISIS = [
+    'I want to die.',
+    'Sometimes I think about suicide.',
+    'I don\'t want to live like this anymore.',
+    'I have been thinking about killing myself.',
+]
+
+# Answers to the four questions of the my_eliza crisis questionnaire
+ANSWERS = [
+    ['bad', 'awful', 'I feel hopeless'],
+    ['very', 'not very', 'they come and go'],
+    ['hours', 'all day', 'a few minutes'],
+    ['no', 'yes', 'not sure'],
+]
+
+QUITS = ['bye', 'goodbye', 'quit']
+
+# Relative frequency of each kind of exchange in a conversation
+MIX = {'keys': 6, 'goto': 2, 'memory': 2, 'crisis': 0.1}
+
+
+def _fill(rng, template):
+    return template.format(family=rng.choice(FAMILY),
+                           feeling=rng.choice(FEELINGS),
+                           thing=rng.choice(THINGS),
+                           place=rng.choice(PLACES))
+
+
+def conversation(rng, turns=12, mix=MIX):
+    """Return a synthetic conversation as a list of (kind, utterance).
+
+    Exchanges are drawn by kind until there are at least turns utterances,
+    and the conversation ends with a quit word (kind 'quit').
+    """
+    kinds = sorted(mix)
+    weights = [mix[kind] for kind in kinds]
+    utterances = []
+    while len(utterances) < turns:
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'keys':
+            texts = [_fill(rng, rng.choice(KEYS))]
+        elif kind == 'goto':
+            texts = [_fill(rng, rng.choice(GOTOS))]
+        elif kind == 'memory':
+            texts = [_fill(rng, rng.choice(SAVES)), rng.choice(UNMATCHED)]
+            if rng.random() < 0.5:
+                # my_eliza brings up a remembered noun phrase on yes/no
+                texts.append(rng.choice(['yes', 'no']))
+        elif kind == 'crisis':
+            texts = [rng.choice(CRISIS)] + [rng.choice(a) for a in ANSWERS]
+        else:
+            raise ValueError("Unknown kind of exchange {}".format(kind))
+        utterances.extend((kind, text) for text in texts)
+    utterances.append(('quit', rng.choice(QUITS)))
+    return utterances
+
+
+PAGE_SIZE = mmap.PAGESIZE
+
+
+def rss(pid=None):
+    """Return the resident set size of process pid in bytes, or None.
+
+    pid defaults to this process. Needs /proc, so is None off Linux.
+    """
+    try:
+        with open('/proc/{}/statm'.format(pid or 'self')) as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def percentiles(latencies, points=(50, 95, 99)):
+    """Return the nearest-rank percentiles and the maximum of latencies."""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+    result = dict(('p{}'.format(point),
+                   ordered[max(0, -(-len(ordered) * point // 100) - 1)])
+                  for point in points)
+    result['max'] = ordered[-1]
+    return result
+
+
+class EngineTarget:
+    """Conversations with an engine in this process."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sessions = set()
+
+    async def open(self):
+        session = self.engine.new_session()
+        self.sessions.add(session)
+        return session
+
+    async def say(self, session, text):
+        return await self.engine.respond_async(text, session)
+
+    async def close(self, session):
+        self.sessions.discard(session)
+
+    def footprint(self):
+        return sum(session.footprint() for session in self.sessions)
+
+
+class SocketTarget:
+    """Conversations over connections to server.py."""
+
+    def __init__(self, host='127.0.0.1', port=8023, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+
+    async def open(self):
+        if self.path:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        await reader.readline()     # greeting
+        return reader, writer
+
+    async def say(self, connection, text):
+        reader, writer = connection
+        writer.write((text + '\n').encode('utf-8'))
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError('Server closed the connection')
+        return line.decode('utf-8', 'replace').rstrip('\n')
+
+    async def close(self, connection):
+        writer = connection[1]
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def footprint(self):
+        return None
+
+
+class LoadGenerator:
+    def __init__(self, target, conversations=1000, concurrency=100, turns=12,
+                 think=0.0, seed=0, pid=None, interval=1.0, mix=MIX):
+        self.target = target
+        self.conversations = conversations
+        self.concurrency = concurrency
+        self.turns = turns
+        self.think = think
+        self.rng = random.Random(seed)
+        self.pid = pid
+        self.interval = interval
+        self.mix = mix
+        self.latencies = {}     # kind -> seconds per turn
+        self.completed = 0      # turns
+        self.errors = 0         # conversations cut short
+        self.samples = []
+
+    async def _client(self, scripts):
+        # clients share one generator, so conversations are drawn in order
+        for utterances in scripts:
+            connection = await self.target.open()
+            try:
+                for kind, text in utterances:
+                    start = time.perf_counter()
+                    await self.target.say(connection, text)
+                    self.latencies.setdefault(kind, []).append(
+                        time.perf_counter() - start)
+                    self.completed += 1
+                    # lets other conversations in between turns
+                    await asyncio.sleep(
+                        self.rng.expovariate(1 / self.think) if self.think else 0)
+            except (ConnectionError, OSError) as e:
+                log.debug('Conversation failed: %s', e)
+                self.errors += 1
+            finally:
+                await self.target.close(connection)
+
+    def _sample(self, start, live):
+        sample = {'time': time.perf_counter() - start, 'turns': self.completed,
+                  'rss': rss(self.pid) if self.pid else None,
+                  'sessions': live, 'footprint': self.target.footprint()}
+        self.samples.append(sample)
+        log.info('%5.1fs %8d turns %7s MB rss %6d sessions', sample['time'],
+                 sample['turns'],
+                 '-' if sample['rss'] is None else
+                 '{:.1f}'.format(sample['rss'] / 2 ** 20), live)
+
+    async def _sampler(self, start, clients):
+        while True:
+            await asyncio.sleep(self.interval)
+            self._sample(start, sum(not client.done() for client in clients))
+
+    async def run(self):
+        """Run every conversation and return the report as a dict."""
+        scripts = (conversation(self.rng, self.turns, self.mix)
+                   for _ in range(self.conversations))
+        start = time.perf_counter()
+        self._sample(start, 0)
+        clients = [asyncio.ensure_future(self._client(scripts))
+                   for _ in range(min(self.concurrency, self.conversations))]
+        sampler = asyncio.ensure_future(self._sampler(start, clients))
+        try:
+            await asyncio.gather(*clients)
+        finally:
+            sampler.cancel()
+        seconds = time.perf_counter() - start
+        self._sample(start, 0)
+
+        every = [latency for latencies in self.latencies.values()
+                 for latency in latencies]
+        latency = dict((kind, percentiles(latencies))
+                       for kind, latencies in self.latencies.items())
+        latency['all'] = percentiles(every)
+        first, last = self.samples[0]['rss'], self.samples[-1]['rss']
+        return {
+            'conversations': self.conversations,
+            'concurrency': self.concurrency,
+            'turns': self.completed,
+            'errors': self.errors,
+            'seconds': seconds,
+            'throughput': self.completed / seconds if seconds else None,
+            'latency': latency,
+            'rss_growth': None if first is None or last is None else last - first,
+            'samples': self.samples,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', choices=sorted(SCRIPTS), default='eliza',
+                        help='engine to run in this process')
+    parser.add_argument('--script')
+    parser.add_argument('--port', type=int,
+                        help='talk to server.py on this port instead')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--unix', help='talk to server.py on this Unix socket')
+    parser.add_argument('--pid', type=int,
+                        help='sample the RSS of this process (the server)')
+    parser.add_argument('--conversations', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--turns', type=int, default=12,
+                        help='utterances per conversation, before the quit')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='mean seconds between the turns of a conversation')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between RSS samples')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write JSON results here')
+    args = parser.parse_args()
+
+    pid = args.pid
+    if args.port or args.unix:
+        target = SocketTarget(args.host, args.port, args.unix)
+    else:
+        engine = load_engine(args.engine, args.script, crisis_report_path=None)
+        target = EngineTarget(engine)
+        pid = pid or os.getpid()
+    generator = LoadGenerator(target, args.conversations, args.concurrency,
+                              args.turns, args.think, args.seed, pid,
+                              args.interval)
+    results = asyncio.run(generator.run())
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
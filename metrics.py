@@ -0,0 +1,79 @@
+"""Per-stage counts and latency histograms for Eliza.respond().
+
+Metrics are off unless an engine is instrumented:
+
+    metrics = Metrics()
+    engine.instrument(metrics)
+    ...
+    metrics.write('eliza.prom')
+
+Instrumenting replaces the engine's stage methods with timed wrappers on
+that one instance, so an engine that is not instrumented runs no metrics
+code at all. The file is written in the Prometheus text format, suitable
+for the node exporter's textfile collector or for reading directly.
+"""
+import bisect
+import os
+import time
+
+# Upper bounds in seconds of the histogram buckets; a final +Inf bucket
+# catches the rest
+BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+           1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+
+class Metrics:
+    def __init__(self, prefix='eliza', buckets=BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.histograms = {}    # stage -> per-bucket counts, +Inf last
+        self.sums = {}          # stage -> total seconds
+
+    def observe(self, stage, seconds):
+        counts = self.histograms.get(stage)
+        if counts is None:
+            counts = self.histograms[stage] = [0] * (len(self.buckets) + 1)
+            self.sums[stage] = 0.0
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sums[stage] += seconds
+
+    def count(self, stage):
+        return sum(self.histograms.get(stage, ()))
+
+    def wrap(self, stage, func):
+        """Return func wrapped to record each call's duration under stage."""
+        observe = self.observe
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(stage, clock() - start)
+        timed.__wrapped__ = func
+        return timed
+
+    def format(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        name = self.prefix + '_stage_seconds'
+        lines = ['# HELP {} Time spent in each respond() stage.'.format(name),
+                 '# TYPE {} histogram'.format(name)]
+        for stage in sorted(self.histograms):
+            total = 0
+            bounds = ['{:g}'.format(b) for b in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, self.histograms[stage]):
+                total += count
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(
+                    name, stage, bound, total))
+            lines.append('{}_sum{{stage="{}"}} {!r}'.format(
+                name, stage, self.sums[stage]))
+            lines.append('{}_count{{stage="{}"}} {}'.format(name, stage, total))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Atomically replace path with the current metrics."""
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as file:
+            file.write(self.format())
+        os.replace(tmp_path, path)
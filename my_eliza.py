@@ -1,18 +1,17 @@
+import asyncio
 import logging
+import multiprocessing
+import os
 import random
-import re
-from collections import namedtuple
-import nltk
-from nltk.sentiment import SentimentIntensityAnalyzer
-from nltk.tag import pos_tag
-from nltk import RegexpParser
-import spacy
-
-nltk.download('vader_lexicon')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('punkt')
-nltk.download('maxent_ne_chunker')
-nltk.download('words')
+import string
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import crisis
+import eliza
+from eliza import LRUCache
 
 # Fix Python2/Python3 incompatibility
 try: input = raw_input
@@ -21,36 +20,218 @@ except NameError: pass
 log = logging.getLogger(__name__)
 
 
-class Key:
-    def __init__(self, word, weight, decomps):
-        self.word = word
-        self.weight = weight
-        self.decomps = decomps
+# NLTK and its models are only imported when a stage first needs them, so
+# importing this module and creating an Eliza stays fast. Each entry gives a
+# builder and the NLTK data packages it may need to download.
+def _build_sentiment():
+    from nltk.sentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+def _build_tagger():
+    from nltk.tag import PerceptronTagger
+    return PerceptronTagger()
+
+
+def _build_chunker():
+    from nltk import RegexpParser
+    #define a noun phrase: optional determiner, optional adjective(s), and a noun
+    return RegexpParser('NP: {<DT>?<JJ>*<NN.*>+}')
+
+
+# Session-independent result of preparing one input for respond()
+# crisis holds the crisis phrases found in the text; script is the Script the
+# turn was prepared with
+Turn = namedtuple('Turn', ['text', 'lower', 'crisis', 'quit', 'yes_no',
+                           'cleaned', 'words', 'lowered', 'noun_phrases',
+                           'keys', 'possible', 'sentiment', 'script'],
+                  defaults=(False, None, None, None, (), (), None, None, None))
+
+NLP_MODELS = {
+    'sentiment': (_build_sentiment, ['vader_lexicon']),
+    'tagger': (_build_tagger, ['averaged_perceptron_tagger',
+                               'averaged_perceptron_tagger_eng']),
+    'chunker': (_build_chunker, []),
+}
+
+
+# Result of the NLP stages when they are skipped: no noun phrases to
+# remember and no sentiment prefix
+DEGRADED = ((), None)
+
+# NLP-only engine of the current process pool worker, set by _init_nlp_worker
+_nlp_engine = None
+
+
+def _init_nlp_worker(offline, sentiment_cache_size, noun_phrase_cache_size):
+    global _nlp_engine
+    _nlp_engine = Eliza(offline=offline,
+                        sentiment_cache_size=sentiment_cache_size,
+                        noun_phrase_cache_size=noun_phrase_cache_size)
 
 
-class Decomp:
-    def __init__(self, parts, save, reasmbs):
-        self.parts = parts
-        self.save = save
-        self.reasmbs = reasmbs
-        self.next_reasmb_index = 0
+def _nlp_job(words, cleaned, score):
+    return _nlp_engine._nlp_stages(words, cleaned, score)
+
+
+def _maxsize(cache):
+    return 0 if cache is None else cache.maxsize
+
+
+class NLPPool:
+    """Runs the NLP stages of turns on a thread or process pool.
+
+    At most max_pending turns are queued or running; a turn arriving when
+    the pool is full, or whose stages take longer than deadline seconds,
+    gets DEGRADED instead, so its scripted reply is not held up. Threads
+    share the engine and its caches, but NLTK holds the GIL for most of
+    its work; processes each load their own models and run in parallel.
+    """
+
+    def __init__(self, engine, workers, executor='thread', max_pending=64,
+                 deadline=0.25):
+        if executor == 'thread':
+            self.executor = ThreadPoolExecutor(workers, 'eliza-nlp')
+            self.job = engine._nlp_stages
+        elif executor == 'process':
+            self.executor = ProcessPoolExecutor(
+                workers, multiprocessing.get_context('spawn'),
+                _init_nlp_worker, (engine.offline,
+                                   _maxsize(engine.sentiment_cache),
+                                   _maxsize(engine.noun_phrase_cache)))
+            self.job = _nlp_job
+        else:
+            raise ValueError("Unknown NLP executor {}".format(executor))
+        self.deadline = deadline
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.completed = 0
+        self.saturated = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def run(self, words, cleaned, score=True):
+        """Return the noun phrases and sentiment score of one input, or
+        DEGRADED if they cannot be had in time."""
+        if not self.slots.acquire(blocking=False):
+            self.saturated += 1
+            return DEGRADED
+        try:
+            future = self.executor.submit(self.job, words, cleaned, score)
+        except RuntimeError:
+            # shut down, or a broken process pool
+            self.slots.release()
+            log.exception('Could not queue NLP stages')
+            self.errors += 1
+            return DEGRADED
+        # a turn that times out before it starts is cancelled, freeing its slot
+        future.add_done_callback(lambda future: self.slots.release())
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future),
+                                            self.deadline)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return DEGRADED
+        except Exception:
+            log.exception('NLP stages failed')
+            self.errors += 1
+            return DEGRADED
+        self.completed += 1
+        return result
+
+    def stats(self):
+        return {'completed': self.completed, 'saturated': self.saturated,
+                'timeouts': self.timeouts, 'errors': self.errors}
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait, cancel_futures=True)
+
+
+class Session(eliza.Session):
+    def __init__(self, id=None, memory_size=eliza.MEMORY_SIZE):
+        super().__init__(id, memory_size)
+        # memory stores entire responses based on keywords in prev inputs
+        self.memory_keys = eliza.Memory(memory_size)   # stores keywords only
+        self.last_input = None
+        self.crisis_responses = None    # answers so far while in the crisis questionnaire
+
+    def footprint(self):
+        return super().footprint() + self.memory_keys.footprint()
+
+    def state(self):
+        crisis_responses = self.crisis_responses
+        if crisis_responses is not None:
+            crisis_responses = tuple(crisis_responses)
+        return super().state() + (tuple(self.memory_keys), self.last_input,
+                                  crisis_responses)
+
+    def restore(self, state):
+        super().restore(state[:-3])
+        memory_keys, self.last_input, crisis_responses = state[-3:]
+        self.memory_keys = eliza.Memory(self.memory.capacity)
+        for phrase in memory_keys:
+            self.memory_keys.add(phrase)
+        if crisis_responses is not None:
+            crisis_responses = list(crisis_responses)
+        self.crisis_responses = crisis_responses
+
+
+class Eliza(eliza.Eliza):
+    session_class = Session
+
+    STAGES = dict(eliza.Eliza.STAGES,
+                  _detect_crisis='crisis',
+                  sentiment_score='sentiment',
+                  noun_phrases_many='pos_chunking')
+
+    def __init__(self, offline=None, crisis_lexicon=crisis.LEXICON,
+                 crisis_report_path='crisis_reports.jsonl',
+                 memory_size=eliza.MEMORY_SIZE, response_cache_size=0,
+                 sentiment_cache_size=4096, noun_phrase_cache_size=4096,
+                 nlp_workers=0, nlp_executor='thread', nlp_deadline=0.25,
+                 nlp_queue=64):
+        super().__init__(memory_size, response_cache_size)
+
+        # offline mode never downloads NLTK data; stages whose data is not
+        # already installed are skipped instead
+        if offline is None:
+            offline = bool(os.environ.get('ELIZA_OFFLINE'))
+        self.offline = offline
+        self.nlp_models = {}
+        self.nlp_lock = threading.Lock()    # loads each model once
+        self.noun_phrase_cache = (LRUCache(noun_phrase_cache_size)
+                                  if noun_phrase_cache_size else None)
+        self.sentiment_cache = (LRUCache(sentiment_cache_size)
+                                if sentiment_cache_size else None)
+        self.sentiment_skips = 0    # inputs scored without calling VADER
+
+        self.memory_prompts = [
+            "You spoke before about '{}'. Tell me more about that.",
+            "Let's return to '{}'. How does this relate to your current thoughts?"
+        ]
 
+        self.crisis_phrases = crisis.PhraseMatcher(crisis.load_lexicon(crisis_lexicon))
+        # None turns crisis reports off, e.g. for benchmarks and replays
+        self.crisis_report_path = crisis_report_path
+        self.crisis_reports = None    # started on the first report
 
-class Eliza:
-    def __init__(self):
-        self.initials = []
-        self.finals = []
-        self.quits = []
-        self.pres = {}
-        self.posts = {}
-        self.synons = {}
-        self.keys = {}
-        self.memory = []    # stores entire responses from memory based on keywords in prev inputs
-        self.memory_keys = []   # stores keywords only
+        self.crisis_resources = [
+            "National Suicide Prevention Lifeline: 988 or 1-800-273-8255",
+            "Crisis Text Line: Text HOME to 741741"
+        ]
 
-        self.suicide_keywords = ['suicide', 'suicidal', 'don\'t want to live', 'kill myself', 'want to die', 'want to kill myself', 'want to die', 'want to kill myself', 'kms']
+        self.crisis_topics = [
+            'Self Description',
+            'Intensity Report',
+            'Duration Report',
+            'Plan'
+        ]
 
-        self.sia = SentimentIntensityAnalyzer()
+        self.crisis_questions = [
+            'I hear that you are in pain. Can you tell me a bit about the suicidal thoughts?',
+            'How intense are these thoughts?',
+            'How long do the thoughts last?',
+            'Have you made a plan?',
+        ]
 
         self.sentiment_responses = {
             'very_neg': [
@@ -77,198 +258,220 @@ class Eliza:
             ]
         }
 
-    def load(self, path):
-        key = None
-        decomp = None
-        with open(path) as file:
-            for line in file:
-                line = line.strip()
-                # Skip empty lines or lines without a colon
-                if not line or ':' not in line:
-                    continue
-                tag, content = [part.strip() for part in line.split(':', 1)]
-                if tag == 'initial':
-                    self.initials.append(content)
-                elif tag == 'final':
-                    self.finals.append(content)
-                elif tag == 'quit':
-                    self.quits.append(content)
-                elif tag == 'pre':
-                    parts = content.split(' ')
-                    self.pres[parts[0]] = parts[1:]
-                elif tag == 'post':
-                    parts = content.split(' ')
-                    self.posts[parts[0]] = parts[1:]
-                elif tag == 'synon':
-                    parts = content.split(' ')
-                    self.synons[parts[0]] = parts
-                elif tag == 'key':
-                    parts = content.split(' ')
-                    word = parts[0]
-                    weight = int(parts[1]) if len(parts) > 1 else 1
-                    key = Key(word, weight, [])
-                    self.keys[word] = key
-                elif tag == 'decomp':
-                    parts = content.split(' ')
-                    save = False
-                    if parts[0] == '$':
-                        save = True
-                        parts = parts[1:]
-                    decomp = Decomp(parts, save, [])
-                    key.decomps.append(decomp)
-                elif tag == 'reasmb':
-                    parts = content.split(' ')
-                    decomp.reasmbs.append(parts)
-
-    def _match_decomp_r(self, parts, words, results):
-        if not parts and not words:
-            return True
-        if not parts or (not words and parts != ['*']):
-            return False
-        if parts[0] == '*':
-            for index in range(len(words), -1, -1):
-                results.append(words[:index])   # captures matched words from user input
-                if self._match_decomp_r(parts[1:], words[index:], results):
-                    return True
-                results.pop()
-            return False
-        elif parts[0].startswith('@'):
-            root = parts[0][1:]
-            if not root in self.synons:
-                raise ValueError("Unknown synonym root {}".format(root))
-            if not words[0].lower() in self.synons[root]:
-                return False
-            results.append([words[0]])
-            return self._match_decomp_r(parts[1:], words[1:], results)
-        elif parts[0].lower() != words[0].lower():
-            return False
-        else:
-            return self._match_decomp_r(parts[1:], words[1:], results)
-
-    def _match_decomp(self, parts, words):
-        results = []
-        if self._match_decomp_r(parts, words, results):
-            return results
-        return None
-
-    def _next_reasmb(self, decomp):
-        index = decomp.next_reasmb_index
-        result = decomp.reasmbs[index % len(decomp.reasmbs)]
-        decomp.next_reasmb_index = index + 1
-        return result
+        # respond_async() runs the NLP stages here, off the event loop
+        self.nlp_pool = None
+        if nlp_workers:
+            self.nlp_pool = NLPPool(self, nlp_workers, nlp_executor,
+                                    nlp_queue, nlp_deadline)
+
+    @property
+    def sia(self):
+        return self._nlp_model('sentiment')
+
+    def _nlp_model(self, name):
+        try:
+            return self.nlp_models[name]
+        except KeyError:
+            pass
+        with self.nlp_lock:
+            if name not in self.nlp_models:
+                self.nlp_models[name] = self._load_nlp_model(name)
+            return self.nlp_models[name]
+
+    def _load_nlp_model(self, name):
+        build, resources = NLP_MODELS[name]
+        try:
+            return build()
+        except ImportError:
+            log.warning('NLTK is not installed, skipping %s', name)
+            return None
+        except LookupError:
+            if self.offline:
+                log.warning('NLTK data for %s is not installed, skipping it', name)
+                return None
+        import nltk
+        for resource in resources:
+            nltk.download(resource, quiet=True)
+        try:
+            return build()
+        except LookupError:
+            log.warning('Could not download NLTK data for %s, skipping it', name)
+            return None
 
-    def _reassemble(self, reasmb, results):
-        output = []
-        for reword in reasmb:
-            if not reword:
-                continue
-            if reword[0] == '(' and reword[-1] == ')':
-                index = int(reword[1:-1])   # gets the number of the matched wordss from user input
-                if index < 1 or index > len(results):
-                    raise ValueError("Invalid result index {}".format(index))
-                insert = results[index - 1] # uses the captured text from user input
-                for punct in [',', '.', ';']:
-                    if punct in insert:
-                        insert = insert[:insert.index(punct)]
-                output.extend(insert)
-            else:
-                output.append(reword)
+    # unlike eliza.py, the input is remembered too and the saved
+    # response is replied at once
+    def _save(self, decomp, words, output, session):
+        # Store the complete response
+        response = ' '.join(output)
+        # Store the original input
+        key_phrase = ' '.join(words)
+
+        # Only store if not empty
+        if key_phrase.strip() and response.strip():
+            session.memory_keys.add(key_phrase)
+            session.memory.add(tuple(output))
+            log.debug('Saved to memory - Key: %s, Response: %s', key_phrase, response)
         return output
 
-    def _sub(self, words, sub):
-        output = []
-        for word in words:
-            word_lower = word.lower()
-            if word_lower in sub:
-                output.extend(sub[word_lower])
-            else:
-                output.append(word)
-        return output
+    def _handle_crisis(self, text, session):
+        # Runs the screening questionnaire one turn at a time: the first call
+        # asks the first question, and each later call records the answer and
+        # asks the next one until the report can be written.
+        if session.crisis_responses is None:
+            session.crisis_responses = []
+        else:
+            session.crisis_responses.append(text)
 
+        responses = session.crisis_responses
+        if len(responses) < len(self.crisis_questions):
+            return self.crisis_questions[len(responses)]
 
-    # matches key words and sorts them by weight
-    def _match_key(self, words, key):
-        for decomp in key.decomps:
-            results = self._match_decomp(decomp.parts, words)
-            if results is None:
-                log.debug('Decomp did not match: %s', decomp.parts)
-                continue
-            
-            results = [self._sub(words, self.posts) for words in results]
-            reasmb = self._next_reasmb(decomp)
-            
-            if reasmb[0] == 'goto':
-                goto_key = reasmb[1]
-                if not goto_key in self.keys:
-                    raise ValueError("Invalid goto key {}".format(goto_key))
-                return self._match_key(words, self.keys[goto_key])
-            
-            output = self._reassemble(reasmb, results)
-            if decomp.save:
-                # Store the complete response
-                response = ' '.join(output)
-                # Store the original input
-                key_phrase = ' '.join(words)
-                
-                # Only store if not empty
-                if key_phrase.strip() and response.strip():
-                    self.memory_keys.append(key_phrase)
-                    self.memory.append(response)
-                    log.debug('Saved to memory - Key: %s, Response: %s', key_phrase, response)
-            return output
-        return None
-    
-    def _handle_crisis(self):
-
-        crisis_resources = [
-            "National Suicide Prevention Lifeline: 988 or 1-800-273-8255 \n",
-            "Crisis Text Line: Text HOME to 741741 \n"
-        ]
-        
-        crisis_topics = [
-            'Self Description',
-            'Intensity Report',
-            'Duration Report',
-            'Plan'
-        ]
+        session.crisis_responses = None
+        self._write_crisis_report(responses, session)
 
-        crisis_questions = [
-            'I hear that you are in pain. Can you tell me a bit about the suicidal thoughts?',
-            'How intense are these thoughts?',
-            'How long do the thoughts last?',
-            'Have you made a plan?',
+        lines = [
+            'Thank you for sharing this with me. Please know that you are not alone, and that there are resources available to you.',
+            'Here are some resources:',
+            '----------------------------------',
         ]
-        
-        responses = []
-
-        for question in crisis_questions:
-            response = input(question + ' > ')
-            responses.append(response)
-
-        print('Thank you for sharing this with me. Please know that you are not alone, and that there are resources available to you. \\')
-        print('Here are some resources: \n\n')
-        print('----------------------------------')
-        for resource in crisis_resources:
-            print(resource)
-        print('----------------------------------')
-        print('I have compiled your responses, and I recommend you send this report to a mental health professional in your area to receive specialized support.\n')
-
-        with open('suicide_responses.txt', 'w') as file:
-            file.write('Suicide Risk Report\n')
-            for topic, response in zip(crisis_topics, responses):
-                file.write(f"{topic}: {response}\n")
+        lines.extend(self.crisis_resources)
+        lines.append('----------------------------------')
+        lines.append('I have compiled your responses, and I recommend you send this report to a mental health professional in your area to receive specialized support.')
+        return '\n'.join(lines)
+
+    def _stream_turn(self, text, session):
+        # Crisis turns carry a structured event, so batch consumers do not
+        # have to recognise the questionnaire from its wording.
+        in_crisis = session.crisis_responses is not None
+        record = super()._stream_turn(text, session)
+        answered = session.crisis_responses
+        if answered is not None:
+            record.update(event='crisis', topic=self.crisis_topics[len(answered)],
+                          question=len(answered) + 1)
+        elif in_crisis:
+            record.update(event='crisis_complete',
+                          resources=list(self.crisis_resources))
+        return record
+
+    def _write_crisis_report(self, responses, session):
+        if self.crisis_report_path is None:
+            return
+
+        report = {
+            'session': session.id,
+            'time': time.time(),
+            'responses': dict(zip(self.crisis_topics, responses)),
+        }
 
-            # SAMHSA considers a high risk if the person has a plan
-            if responses[3] == 'yes':
-                file.write('Suicide Risk: High\n')
+        # SAMHSA considers a high risk if the person has a plan
+        if responses[3] == 'yes':
+            report['risk'] = 'High'
+
+        # SAMHSA considers a high risk if the person declines to answer screening questions
+        if 'no' in responses or 'No' in responses:
+            report['declined'] = True
+
+        # queued for the background writer so the turn never waits on disk
+        if self.crisis_reports is None:
+            try:
+                self.crisis_reports = crisis.ReportWriter(self.crisis_report_path)
+            except OSError:
+                # tried again on the next report
+                log.exception('Could not open crisis report file %s',
+                              self.crisis_report_path)
+                return
+        self.crisis_reports.write(report)
+
+    def noun_phrases(self, words):
+        """Return the multi-word noun phrases in words, cached by token tuple."""
+        return self.noun_phrases_many([words])[0]
+
+    def noun_phrases_many(self, sentences):
+        """Return the noun phrases of each sentence in sentences.
+
+        Sentences missing from the cache are tagged together in one batch.
+        """
+        sentences = [tuple(words) for words in sentences]
+        cache = self.noun_phrase_cache
+        results = [None if cache is None else cache.get(tokens)
+                   for tokens in sentences]
+        missing = list(OrderedDict.fromkeys(
+            tokens for tokens, found in zip(sentences, results) if found is None))
+        if not missing:
+            return results
 
-            # SAMHSA considers a high risk if the person declines to answer screening questions
-            if 'no' in responses or 'No' in responses:
-                file.write('Declined to answer screening questions, be advised.')
+        tagger = self._nlp_model('tagger')
+        chunk_parser = self._nlp_model('chunker')
+        if tagger is None or chunk_parser is None:
+            return [found or () for found in results]
 
-    def _get_sentiment_based_response(self, text):
-        scores = self.sia.polarity_scores(text)    # NLKT sentiment analysis
-        compound_score = scores['compound']
+        # parse the pos tagged inputs
+        extracted = {}
+        for tokens, pos_tags in zip(missing, tagger.tag_sents(missing)):
+            tree = chunk_parser.parse(pos_tags)
+            noun_phrases = []
+            for subtree in tree.subtrees(filter=lambda t: t.label() == 'NP'):
+                phrase = ' '.join(word for word, tag in subtree.leaves())
+
+                if len(phrase.split()) > 1 and (len(phrase) > 3 and 
+                                               not phrase.lower() in ['the', 'this', 'that', 'she', 'he', 'it', 'we', 'you', 'they', 'i']):
+                    noun_phrases.append(phrase)
+            extracted[tokens] = tuple(noun_phrases)
+            if cache is not None:
+                cache.put(tokens, extracted[tokens])
+
+        return [extracted[tokens] if found is None else found
+                for tokens, found in zip(sentences, results)]
+
+    def sentiment_score(self, text):
+        """Return the VADER compound score of text, or None without VADER.
+
+        Scores are cached by whitespace-normalized text. Case is kept, as
+        VADER scores all-caps words higher. Text with no word from the VADER
+        lexicon always scores 0.0, so it is not sent to VADER at all.
+        """
+        sia = self.sia
+        if sia is None:
+            return None
+        text = ' '.join(text.split())
+        cache = self.sentiment_cache
+        score = None if cache is None else cache.get(text)
+        if score is None:
+            if self._has_sentiment_words(sia, text):
+                score = sia.polarity_scores(text)['compound']    # NLKT sentiment analysis
+            else:
+                self.sentiment_skips += 1
+                score = 0.0
+            if cache is not None:
+                cache.put(text, score)
+        return score
+
+    def _has_sentiment_words(self, sia, text):
+        lexicon = getattr(sia, 'lexicon', None)
+        if lexicon is None or not text.isascii():
+            # unknown analyzer, or emoji that VADER translates into words
+            return True
+        for word in text.lower().split():
+            if word in lexicon or word.strip(string.punctuation) in lexicon:
+                return True
+        return False
+
+    def cache_stats(self):
+        """Return the size and hit/miss counts of the NLP caches.
+
+        A cache turned off with a size of 0 has no counts.
+        """
+        sentiment = {} if self.sentiment_cache is None else self.sentiment_cache.stats()
+        sentiment['skipped'] = self.sentiment_skips
+        return {'sentiment': sentiment,
+                'noun_phrases': ({} if self.noun_phrase_cache is None
+                                 else self.noun_phrase_cache.stats())}
+
+    def _get_sentiment_based_response(self, text, compound_score=None):
+        if compound_score is None:
+            compound_score = self.sentiment_score(text)
+            if compound_score is None:
+                return None
 
         # VADER compound score ranges from -1 (very negative) to +1 (very positive)
         if compound_score <= -0.5:
@@ -284,135 +487,160 @@ class Eliza:
         else:
             return random.choice(self.sentiment_responses['neutral'])
 
-    def respond(self, text):
-        # Add early return for repeated one-word responses
-        if text.lower() in ['yes', 'no'] and hasattr(self, 'last_input') and self.last_input == text.lower():
-            return "I notice you're repeating yourself. Would you like to tell me more about what's on your mind?"
-        
-        self.last_input = text.lower()
+    def _compound_score(self, turn):
+        # Scored at most once per prepared turn, so repeated texts in
+        # respond_many() share one VADER call.
+        if 'compound' not in turn.sentiment:
+            score = self.sentiment_score(turn.cleaned)
+            if score is None:
+                return None
+            turn.sentiment['compound'] = score
+        return turn.sentiment['compound']
+
+    def _nlp_stages(self, words, cleaned, score=True):
+        # The slow, session-independent part of a turn, as run by NLPPool
+        return (self.noun_phrases(words),
+                self.sentiment_score(cleaned) if score else None)
+
+    def _detect_crisis(self, text):
+        found = tuple(self.crisis_phrases.find(text))
+        if found:
+            log.debug('Crisis phrases: %s', found)
+        return found
+
+    def _prepare(self, text, tag=True, script=None):
+        if script is None:
+            script = self.script
+        lower = text.lower()
 
         # Existing suicide check
-        if any(keyword in text.lower() for keyword in self.suicide_keywords):
-            return self._handle_crisis()
-
-        if text.lower() in self.quits:
-            return None
-
-        # cleans up punctuation
-        text = re.sub(r'\s*\.+\s*', ' . ', text)
-        text = re.sub(r'\s*,+\s*', ' , ', text)
-        text = re.sub(r'\s*;+\s*', ' ; ', text)
-        log.debug('After punctuation cleanup: %s', text)
-
-        # splits into words
-        words = [w for w in text.split(' ') if w]
-        log.debug('Input: %s', words)
-
-        memory_prompts = [
-            "You spoke before about '{}'. Tell me more about that.",
-            "Let's return to '{}'. How does this relate to your current thoughts?"
-        ]
-
-        # check for single-word yes/no responses, and uses items from memory if there are any
-        if len(words) == 1 and words[0].lower() in ['yes', 'no']:
-            if self.memory_keys:
-                index = random.randrange(len(self.memory_keys))
-                memory_item = str(self.memory_keys[index])
-                memory_item = ' '.join(memory_item.split())
-                self.memory_keys.pop(index)
-                prompt = random.choice(memory_prompts)
-                return prompt.format(memory_item)
-            else:
-                words = words
-
-        # applies pre-substitutions (converts contractions and common phrases)
-        words = self._sub(words, self.pres)
+        found = self._detect_crisis(text)
+        if found or lower in script.quits:
+            return Turn(text, lower, found, not found)
+
+        # splits into words, separating punctuation, and applies
+        # pre-substitutions (converts contractions and common phrases)
+        tokens, words, lowered = self._tokenize(text, script)
+        cleaned = ' '.join(tokens)
+        yes_no = len(tokens) == 1 and tokens[0].lower() in ['yes', 'no']
         log.debug('After pre-substitution: %s', words)
 
-        #define a noun phrase: optional determiner, optional adjective(s), and a noun
-        noun_phrase = 'NP: {<DT>?<JJ>*<NN.*>+}'
-        chunk_parser = nltk.RegexpParser(noun_phrase)
+        noun_phrases = self.noun_phrases(words) if tag else None
 
-        # parse the pos tagged inputs
-        pos_tags = pos_tag(words)
-        tree = chunk_parser.parse(pos_tags)
+        # finds matching keywords and sorts them by weight
+        keys = self._sorted_keys(lowered, script)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Sorted keys: %s', [(k.word, k.weight) for k in keys])
+
+        return Turn(text, lower, (), False, yes_no, cleaned, words, lowered,
+                    noun_phrases, keys, self._possible_decomps(lowered, script),
+                    {}, script)
+
+    def _prepare_many(self, texts, script=None):
+        turns = dict((text, self._prepare(text, False, script))
+                     for text in set(texts))
+        tagged = [text for text, turn in turns.items() if turn.words is not None]
+        noun_phrases = self.noun_phrases_many([turns[text].words for text in tagged])
+        for text, phrases in zip(tagged, noun_phrases):
+            turns[text] = turns[text]._replace(noun_phrases=phrases)
+        return turns
+
+    async def respond_async(self, text, session=None):
+        """respond() for asyncio callers.
+
+        With an NLP pool, noun-phrase chunking and sentiment run on the pool
+        while the event loop serves other turns. If the pool is full or
+        misses its deadline, the reply goes out without the sentiment
+        prefix and without remembering the turn's noun phrases.
+        """
+        if self.nlp_pool is None:
+            return self.respond(text, session)
+        if session is None:
+            session = self.session
+        script = self.script
+        turn = self._prepare(text, False, script)
+        if turn.words is not None and session.crisis_responses is None:
+            noun_phrases, score = await self.nlp_pool.run(
+                turn.words, turn.cleaned, len(turn.words) > 3)
+            if self.script is not script:
+                # the script was swapped while waiting; match the new one,
+                # under which the text may have become a quit word
+                script = self.script
+                turn = self._prepare(text, False, script)
+            if turn.words is not None:
+                turn = turn._replace(noun_phrases=noun_phrases)
+                turn.sentiment['compound'] = score
+        self._sync_session(session, script)
+        return self._respond_turn(turn, session)
+
+    def _respond_turn(self, turn, session):
+        # Answers to the crisis questionnaire bypass the rest of the pipeline
+        if session.crisis_responses is not None:
+            return self._handle_crisis(turn.text, session)
 
-        noun_phrases = []
-        for subtree in tree.subtrees(filter=lambda t: t.label() == 'NP'):
-            phrase = ' '.join(word for word, tag in subtree.leaves())
+        # Add early return for repeated one-word responses
+        if turn.lower in ['yes', 'no'] and session.last_input == turn.lower:
+            return "I notice you're repeating yourself. Would you like to tell me more about what's on your mind?"
+        
+        session.last_input = turn.lower
 
-            if len(phrase.split()) > 1 and (len(phrase) > 3 and 
-                                           not phrase.lower() in ['the', 'this', 'that', 'she', 'he', 'it', 'we', 'you', 'they', 'i']):
-                noun_phrases.append(phrase)
+        if turn.crisis:
+            return self._handle_crisis(turn.text, session)
 
-            self.memory_keys.extend(noun_phrases)
+        if turn.quit:
+            return None
 
-        # finds matching keywords and sorts them by weight
-        keys = [self.keys[w.lower()] for w in words if w.lower() in self.keys]
-        keys = sorted(keys, key=lambda k: -k.weight)
-        log.debug('Sorted keys: %s', [(k.word, k.weight) for k in keys])
-        log.debug('Sorted keys saved to memory keys: %s', self.memory_keys)
-        log.debug('Current memory keys: %s', self.memory_keys)
+        # check for single-word yes/no responses, and uses items from memory if there are any
+        if turn.yes_no and session.memory_keys:
+            memory_item = session.memory_keys.pop_random()
+            memory_item = ' '.join(memory_item.split())
+            prompt = random.choice(self.memory_prompts)
+            return prompt.format(memory_item)
+
+        words = turn.words
+        for phrase in turn.noun_phrases:
+            session.memory_keys.add(phrase)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('Current memory keys: %s', list(session.memory_keys))
  
         output = None
 
         # generates a response using key words
-        for key in keys:
-            output = self._match_key(words, key)
+        for key in turn.keys:
+            output = self._match_key(words, key, turn.possible, session,
+                                     turn.lowered, turn.script)
             if output:
                 log.debug('Output from key: %s', output)
                 break
 
         # fallback responses if there are no key words
         if not output:
-            if self.memory:
+            if session.memory:
                 # uses a saved response from memory
-                index = random.randrange(len(self.memory))
-                output = self.memory.pop(index)
-                log.debug('Output from memory: %s', output)
+                output = self._recall(session)
             else:
                 # default response if there are responses from memory
-                output = self._next_reasmb(self.keys['xnone'].decomps[0])
-                log.debug('Output from xnone: %s', output)
+                output = self._xnone(session, turn.script)
 
         if output:
             final_response = []
 
             # Increase sentiment response probability for longer inputs
             if len(words) > 3 and random.random() < 0.4:
-                sentiment_response = self._get_sentiment_based_response(text)
-                final_response.extend(sentiment_response.split())
+                compound_score = self._compound_score(turn)
+                if compound_score is not None:
+                    sentiment_response = self._get_sentiment_based_response(
+                        turn.cleaned, compound_score)
+                    final_response.extend(sentiment_response.split())
 
             final_response.extend(output)
             return " ".join(final_response)
         
         return " ".join(output) if output else "Could you tell me more about that?"  # Add default fallback
 
-    def initial(self):
-        return random.choice(self.initials)
-
-    def final(self):
-        return random.choice(self.finals)
-
-    def run(self):
-        print(self.initial())
-
-        while True:
-            sent = input('> ')
-
-            output = self.respond(sent)
-            if output is None:
-                break
-
-            print(output)
-
-        print(self.final())
-
 
 def main():
-    eliza = Eliza()
-    eliza.load('my_doctor.txt')
-    eliza.run()
+    eliza.main(Eliza(), eliza.SCRIPTS['my_eliza'])
 
 
 if __name__ == '__main__':
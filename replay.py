@@ -0,0 +1,83 @@
+"""Replay logged conversations through Eliza across a pool of processes.
+
+Input is JSONL with one conversation per line:
+
+    {"id": "c1", "utterances": ["Hello", "I am sad"]}
+
+An optional "seed" overrides the seed derived from the run seed and the
+conversation id. Every conversation gets a fresh session and its own seed,
+so its responses do not depend on the number of workers or on which worker
+ran it. Output is JSONL in input order, written as results arrive:
+
+    {"id": "c1", "responses": ["...", "..."]}
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import random
+import sys
+
+from eliza import SCRIPTS, load_engine
+
+log = logging.getLogger(__name__)
+
+# Engine of the current worker process, loaded once by _init_worker
+_engine = None
+
+
+def _init_worker(name, script):
+    global _engine
+    _engine = load_engine(name, script, crisis_report_path=None)
+
+
+def _replay_line(args):
+    line, seed = args
+    conversation = json.loads(line)
+    conv_id = conversation.get('id')
+    random.seed(conversation.get('seed', '{}:{}'.format(seed, conv_id)))
+    utterances = conversation['utterances']
+    session = _engine.new_session()
+    responses = _engine.respond_many(utterances, [session] * len(utterances))
+    return {'id': conv_id, 'responses': responses}
+
+
+def replay(lines, engine='eliza', script=None, workers=None, seed=0,
+           chunksize=16):
+    """Yield the replayed result of each JSONL conversation in lines, in order.
+
+    workers=1 replays in this process; otherwise a pool of workers processes
+    is started, each loading the script once.
+    """
+    jobs = ((line, seed) for line in lines if line.strip())
+    if workers == 1:
+        _init_worker(engine, script)
+        for job in jobs:
+            yield _replay_line(job)
+        return
+    with multiprocessing.Pool(workers, _init_worker, (engine, script)) as pool:
+        for result in pool.imap(_replay_line, jobs, chunksize):
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='JSONL conversations, or - for stdin')
+    parser.add_argument('-o', '--output', help='JSONL results (default stdout)')
+    parser.add_argument('--engine', choices=sorted(SCRIPTS), default='eliza')
+    parser.add_argument('--script')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    infile = sys.stdin if args.input == '-' else open(args.input)
+    outfile = open(args.output, 'w') if args.output else sys.stdout
+    with infile, outfile:
+        for result in replay(infile, args.engine, args.script, args.workers,
+                             args.seed):
+            outfile.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    main()
@@ -0,0 +1,205 @@
+"""Line-based chat server for Eliza.
+
+One engine is loaded per process and every connection gets its own Session,
+so thousands of conversations share a single copy of the script. Clients
+send one utterance per line; each reply is written back as one line, with
+the lines of a multi-line reply (such as the crisis resources) joined by
+spaces. The greeting is sent on connect, and a quit word gets the closing
+line before the connection is closed. A line longer than 64 KiB is
+skipped and answered with a short error line.
+"""
+import argparse
+import asyncio
+import logging
+import uuid
+
+from cluster import WorkerError, WorkerPool
+from eliza import SCRIPTS, load_engine
+from metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+
+class ElizaServer:
+    # reply to a line longer than the stream reader's limit (64 KiB)
+    too_long = 'Sorry, that message is too long.'
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connections = 0
+        self.turns = 0
+
+    def open_session(self):
+        return self.engine.new_session()
+
+    async def respond(self, text, session):
+        return await self.engine.respond_async(text, session)
+
+    async def close_session(self, session):
+        pass
+
+    async def handle(self, reader, writer):
+        session = self.open_session()
+        self.connections += 1
+        try:
+            await self._send(writer, self.engine.initial())
+            while True:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError as e:
+                    line = e.partial    # the last line, without a newline
+                except asyncio.LimitOverrunError:
+                    await self._skip_line(reader)
+                    await self._send(writer, self.too_long)
+                    continue
+                if not line:
+                    break
+                text = line.decode('utf-8', 'replace').strip()
+                output = await self.respond(text, session)
+                self.turns += 1
+                if output is None:
+                    await self._send(writer, self.engine.final())
+                    break
+                await self._send(writer, output)
+        except ConnectionError as e:
+            log.debug('Connection dropped: %s', e)
+        except WorkerError as e:
+            # the conversation is gone, so the connection is closed
+            log.error('Conversation %s failed: %s', session, e)
+        finally:
+            self.connections -= 1
+            await self.close_session(session)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _skip_line(self, reader):
+        # drops the rest of an overlong line, so the next one reads cleanly
+        while True:
+            try:
+                await reader.readuntil(b'\n')
+                return
+            except asyncio.IncompleteReadError:
+                return
+            except asyncio.LimitOverrunError as e:
+                await reader.readexactly(e.consumed)
+
+    async def _send(self, writer, text):
+        # one line per reply, so clients can tell where each reply ends
+        writer.write((' '.join(text.splitlines()) + '\n').encode('utf-8'))
+        await writer.drain()
+
+    async def start(self, host='127.0.0.1', port=8023, path=None, backlog=1024):
+        if path:
+            return await asyncio.start_unix_server(self.handle, path=path,
+                                                   backlog=backlog)
+        return await asyncio.start_server(self.handle, host, port,
+                                          backlog=backlog)
+
+
+class ShardedServer(ElizaServer):
+    """ElizaServer that runs each conversation on a worker of a WorkerPool.
+
+    The local engine only supplies the greeting and the closing line.
+    """
+
+    def __init__(self, engine, pool):
+        super().__init__(engine)
+        self.pool = pool
+
+    def open_session(self):
+        return uuid.uuid4().hex
+
+    async def respond(self, text, session):
+        return await self.pool.respond(session, text)
+
+    async def close_session(self, session):
+        await self.pool.close_session(session)
+
+
+async def export_metrics(metrics, path, interval=10.0):
+    """Write metrics to path every interval seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        metrics.write(path)
+
+
+async def serve(engine, host, port, path=None, metrics_path=None,
+                script=None, pool=None):
+    if pool is not None:
+        await pool.start()
+        server = await ShardedServer(engine, pool).start(host, port, path)
+    else:
+        server = await ElizaServer(engine).start(host, port, path)
+    if script:
+        # swap scripts on the event loop, between turns
+        loop = asyncio.get_running_loop()
+        engine.watch(script, schedule=loop.call_soon_threadsafe)
+    log.info('Listening on %s',
+             ', '.join(str(s.getsockname()) for s in server.sockets))
+    if metrics_path:
+        # held so the task is not garbage collected while serving
+        exporter = asyncio.ensure_future(export_metrics(engine.metrics,
+                                                        metrics_path))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', choices=sorted(SCRIPTS), default='eliza')
+    parser.add_argument('--script')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8023)
+    parser.add_argument('--unix', help='listen on a Unix socket at this path')
+    parser.add_argument('--response-cache', type=int, default=0,
+                        help='memoize up to this many matches and reassemblies')
+    parser.add_argument('--reload', action='store_true',
+                        help='reload the script when the file changes')
+    parser.add_argument('--metrics', help='write stage metrics to this file '
+                        'every 10 seconds, in Prometheus text format')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='run conversations on this many worker processes')
+    parser.add_argument('--nlp-workers', type=int, default=0,
+                        help='run my_eliza NLP stages on this many threads '
+                        'or processes, off the event loop')
+    parser.add_argument('--nlp-executor', choices=['thread', 'process'],
+                        default='thread')
+    parser.add_argument('--nlp-deadline', type=float, default=0.25,
+                        help='seconds a turn waits for its NLP stages')
+    parser.add_argument('--nlp-queue', type=int, default=64,
+                        help='turns queued for the NLP stages before more '
+                        'are answered without them')
+    args = parser.parse_args()
+    if args.metrics and args.workers:
+        parser.error('--metrics is not supported with --workers')
+    if args.nlp_workers and (args.workers or args.engine != 'my_eliza'):
+        parser.error('--nlp-workers needs --engine my_eliza and no --workers')
+
+    script = args.script or SCRIPTS[args.engine]
+    options = {}
+    if args.nlp_workers:
+        options = dict(nlp_workers=args.nlp_workers,
+                       nlp_executor=args.nlp_executor,
+                       nlp_deadline=args.nlp_deadline,
+                       nlp_queue=args.nlp_queue)
+    engine = load_engine(args.engine, script,
+                         response_cache_size=args.response_cache, **options)
+    if args.metrics:
+        engine.instrument(Metrics())
+    pool = None
+    if args.workers:
+        pool = WorkerPool(args.engine, script, args.workers, args.reload,
+                          response_cache_size=args.response_cache)
+    try:
+        asyncio.run(serve(engine, args.host, args.port, args.unix,
+                          args.metrics, script if args.reload else None, pool))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,122 @@
+"""On-disk store of session snapshots.
+
+The store is a single append-only log. Each record is a header giving the
+lengths of the session id and the snapshot, then the id and the snapshot;
+a record with an empty snapshot deletes the session. Opening the store
+scans the headers once to index the latest record of every session, so a
+lookup is one read. A record cut short by a crash is dropped on open.
+compact() rewrites the log with only the live records.
+
+    store = SessionStore('sessions.log')
+    store.save(engine, session)
+    session = store.load(engine, session_id)
+"""
+import os
+import struct
+
+# id length, snapshot length
+HEADER = struct.Struct('<HI')
+
+
+class SessionStore:
+    def __init__(self, path):
+        self.path = path
+        self.index = {}     # id -> (offset, length) of the latest snapshot
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.size = self._scan()
+
+    def _scan(self):
+        offset = 0
+        end = os.fstat(self.fd).st_size
+        while offset + HEADER.size <= end:
+            id_length, length = HEADER.unpack(
+                os.pread(self.fd, HEADER.size, offset))
+            data_offset = offset + HEADER.size + id_length
+            if data_offset + length > end:
+                break
+            id = os.pread(self.fd, id_length,
+                          offset + HEADER.size).decode('utf-8')
+            if length:
+                self.index[id] = (data_offset, length)
+            else:
+                self.index.pop(id, None)
+            offset = data_offset + length
+        if offset < end:
+            os.ftruncate(self.fd, offset)
+        return offset
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def _append(self, id, data):
+        key = id.encode('utf-8')
+        os.write(self.fd, HEADER.pack(len(key), len(data)) + key + data)
+        offset = self.size + HEADER.size + len(key)
+        self.size = offset + len(data)
+        return offset
+
+    def put(self, id, data):
+        if not data:
+            raise ValueError("Empty snapshot for session {}".format(id))
+        self.index[id] = (self._append(id, data), len(data))
+
+    def get(self, id):
+        """Return the latest snapshot of session id, or None."""
+        location = self.index.get(id)
+        if location is None:
+            return None
+        offset, length = location
+        return os.pread(self.fd, length, offset)
+
+    def delete(self, id):
+        if self.index.pop(id, None) is not None:
+            self._append(id, b'')
+
+    def save(self, engine, session):
+        self.put(session.id, engine.dump_session(session))
+
+    def load(self, engine, id):
+        """Return the stored Session with this id, or None."""
+        data = self.get(id)
+        return None if data is None else engine.load_session(data)
+
+    def compact(self):
+        """Rewrite the log keeping only the latest snapshot of each session."""
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        index = {}
+        offset = 0
+        with open(tmp_path, 'wb') as file:
+            for id, (data_offset, length) in self.index.items():
+                key = id.encode('utf-8')
+                file.write(HEADER.pack(len(key), length) + key)
+                file.write(os.pread(self.fd, length, data_offset))
+                offset += HEADER.size + len(key)
+                index[id] = (offset, length)
+                offset += length
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        self.index = index
+        self.size = offset
+
+    def flush(self):
+        os.fsync(self.fd)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+import eliza
+import server
+from cluster import HashRing, WorkerError, WorkerPool
+
+
+class HashRingTest(unittest.TestCase):
+    def test_movement(self):
+        ids = ['session-{}'.format(i) for i in range(2000)]
+        ring = HashRing(['a', 'b', 'c'])
+        before = dict((id, ring.node_for(id)) for id in ids)
+        self.assertEqual({'a', 'b', 'c'}, set(before.values()))
+        ring.add('d')
+        moved = [id for id in ids if ring.node_for(id) != before[id]]
+        self.assertTrue(all(ring.node_for(id) == 'd' for id in moved))
+        self.assertLess(len(moved), len(ids) * 0.4)
+        ring.remove('d')
+        self.assertEqual(before, dict((id, ring.node_for(id)) for id in ids))
+
+
+class WorkerPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.pool = WorkerPool('eliza', 'doctor.txt', workers=2)
+        await self.pool.start()
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def test_affinity(self):
+        ids = ['s{}'.format(i) for i in range(20)]
+        replies = await asyncio.gather(
+            *[self.pool.respond(id, 'sorry') for id in ids])
+        self.assertEqual(['Please don\'t apologise.'] * 20, replies)
+        replies = await asyncio.gather(
+            *[self.pool.respond(id, 'sorry') for id in ids])
+        self.assertEqual(['Apologies are not necessary.'] * 20, replies)
+
+        name = await self.pool.add_worker()
+        self.assertIn(name, self.pool.workers)
+        await self.pool.remove_worker('worker-0')
+        replies = await asyncio.gather(
+            *[self.pool.respond(id, 'sorry') for id in ids])
+        self.assertEqual(['I\'ve told you that apologies are not required.'] * 20,
+                         replies)
+        self.assertIsNone(await self.pool.respond('s0', 'bye'))
+
+    async def test_lost_worker(self):
+        ids = ['s{}'.format(i) for i in range(20)]
+        await asyncio.gather(*[self.pool.respond(id, 'sorry') for id in ids])
+        dead = self.pool.workers['worker-0']
+        lost = [id for id in ids if self.pool.worker_for(id) is dead]
+        self.assertTrue(lost)
+        dead.process.kill()
+        dead.process.join()
+        with self.assertLogs('cluster', 'ERROR'):
+            with self.assertRaises(WorkerError):
+                await self.pool.respond(lost[0], 'sorry')
+        replacement = self.pool.workers['worker-0']
+        self.assertIsNot(dead, replacement)
+        self.assertEqual(2, len(self.pool.ring))
+
+        # the lost sessions start afresh, the others carry on
+        replies = await asyncio.gather(
+            *[self.pool.respond(id, 'sorry') for id in ids])
+        self.assertEqual(['Please don\'t apologise.' if id in lost
+                          else 'Apologies are not necessary.' for id in ids],
+                         replies)
+        await self.pool.remove_worker('worker-0')
+        self.assertEqual(['worker-1'], list(self.pool.workers))
+
+    async def test_long_inputs(self):
+        # requests and replies each fill more than a pipe buffer
+        pool = WorkerPool('eliza', 'doctor.txt', workers=1)
+        await pool.start()
+        self.addAsyncCleanup(pool.close)
+        text = 'I remember ' + 'the big blue sea ' * 400
+        replies = await asyncio.wait_for(asyncio.gather(
+            *[pool.respond('s{}'.format(i), text) for i in range(64)]), 30)
+        self.assertEqual(64, len(replies))
+        self.assertTrue(all(reply.startswith('Do you often think of the big')
+                            for reply in replies))
+
+    async def test_server(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        listener = await server.ShardedServer(el, self.pool).start(port=0)
+        self.addAsyncCleanup(listener.wait_closed)
+        self.addCleanup(listener.close)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        await reader.readline()
+        writer.write(b'Men are all alike.\n')
+        self.assertEqual(b'In what way ?\n', await reader.readline())
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import crisis
+
+
+class PhraseMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = crisis.PhraseMatcher(
+            ['suicid*', 'kms', 'want to die', "don't want to live", 'he', 'she'])
+
+    def test_find(self):
+        self.assertEqual(['want to die'],
+                         self.matcher.find('Sometimes I WANT  to die.'))
+        self.assertEqual(['suicid*'], self.matcher.find('feeling suicidal'))
+        self.assertEqual(["don't want to live"],
+                         self.matcher.find('I don’t want to live'))
+        self.assertEqual(['she', 'he'], self.matcher.find('she said he left'))
+
+    def test_word_boundaries(self):
+        self.assertEqual([], self.matcher.find('I walked 5 kmsq'))
+        self.assertEqual([], self.matcher.find('they want to diet'))
+        self.assertEqual([], self.matcher.find('the shed'))
+        self.assertEqual(['kms'], self.matcher.find('kms'))
+
+    def test_lexicon(self):
+        phrases = crisis.load_lexicon()
+        self.assertEqual(len(phrases), len(set(phrases)))
+        matcher = crisis.PhraseMatcher(phrases)
+        for text in ['suicide', 'I want to kill myself', 'kms']:
+            self.assertTrue(matcher.find(text), text)
+        self.assertEqual([], matcher.find('I had a lovely day'))
+
+
+class ReportWriterTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'reports.jsonl')
+
+    def _read(self):
+        with open(self.path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_append(self):
+        writer = crisis.ReportWriter(self.path)
+        writer.write({'session': 'a'})
+        writer.flush()
+        self.assertEqual([{'session': 'a'}], self._read())
+        writer.close()
+        writer = crisis.ReportWriter(self.path)
+        writer.write({'session': 'b'})
+        writer.close()
+        self.assertEqual(['a', 'b'], [r['session'] for r in self._read()])
+
+    def test_concurrent(self):
+        writer = crisis.ReportWriter(self.path, batch_size=7)
+
+        def write(name):
+            for i in range(200):
+                writer.write({'session': name, 'n': i})
+
+        threads = [threading.Thread(target=write, args=(str(t),))
+                   for t in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        reports = self._read()
+        self.assertEqual(1600, len(reports))
+        for t in range(8):
+            self.assertEqual(list(range(200)), [r['n'] for r in reports
+                                                if r['session'] == str(t)])
+
+    def test_errors(self):
+        with self.assertRaises(OSError):
+            crisis.ReportWriter(os.path.join(self.path, 'missing', 'r.jsonl'))
+        writer = crisis.ReportWriter(self.path)
+        with self.assertLogs('crisis', 'ERROR'):
+            writer.write({'session': 'a'})
+            writer.write({'session': 'b', 'time': object()})
+            writer.write({'session': 'c'})
+            writer.flush()
+        writer.close()
+        self.assertEqual(['a', 'c'], [r['session'] for r in self._read()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,13 @@
+import hashlib
+import io
+import json
+import marshal
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 import eliza
 
@@ -68,6 +78,13 @@ class ElizaTest(unittest.TestCase):
         self.assertEqual([[], ['b']],
                          el._match_decomp(['*', 'a', '*'], ['a', 'b']))
 
+    def test_decomp_11(self):
+        el = eliza.Eliza()
+        words = ['x'] * 2000 + ['a'] + ['y'] * 2000 + ['b']
+        self.assertEqual([['x'] * 2000, ['y'] * 2000, []],
+                         el._match_decomp(['*', 'a', '*', 'b', '*'], words))
+        self.assertIsNone(el._match_decomp(['*', 'b', '*', 'a', '*'], words))
+
     def test_syn_1(self):
         el = eliza.Eliza()
         el.load('doctor.txt')
@@ -88,6 +105,29 @@ class ElizaTest(unittest.TestCase):
             el._match_decomp(['*', 'i', 'am', '@sad', '*'],
                              ['its', 'true', 'i', 'am', 'unhappy']))
 
+    def test_syn_4(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        self.assertEqual([['its'], ['very'], ['unhappy'], ['today']],
+                         el._match_decomp(['*', 'i', 'am', '*', '@sad', '*'],
+                                          ['its', 'i', 'am', 'very',
+                                           'unhappy', 'today']))
+        with self.assertRaises(ValueError):
+            el._match_decomp(['@nosuchroot'], ['a'])
+
+    def test_index_1(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        remember = el.keys['remember']
+        possible = el._possible_decomps(['i', 'remember', 'the', 'sea'])
+        self.assertEqual(len(remember.decomps[0].matcher.requirements),
+                         possible[remember.decomps[0]])
+        self.assertLess(possible.get(remember.decomps[1], 0),
+                        len(remember.decomps[1].matcher.requirements))
+        self.assertEqual(['Do', 'you', 'often', 'think', 'of', 'the', 'sea', '?'],
+                         el._match_key(['I', 'remember', 'the', 'sea'], remember,
+                                       possible))
+
     def test_response_1(self):
         el = eliza.Eliza()
         el.load('doctor.txt')
@@ -136,6 +176,249 @@ class ElizaTest(unittest.TestCase):
                 'Lets discuss further why your father is afraid of everybody .',
             ])
 
+    def test_tokenize_1(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        tokens, words, lowered = el._tokenize("Well,, I'm  sad...Really;")
+        self.assertEqual(['Well', ',', "I'm", 'sad', '.', 'Really', ';'], tokens)
+        self.assertEqual(['Well', ',', 'i', 'am', 'sad', '.', 'Really', ';'],
+                         words)
+        self.assertEqual([w.lower() for w in words], lowered)
+
+    def test_session_1(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        first = el.new_session()
+        second = el.new_session()
+        self.assertEqual('Please don\'t apologise.', el.respond('sorry', first))
+        self.assertEqual('Apologies are not necessary.',
+                         el.respond('sorry', first))
+        self.assertEqual('Please don\'t apologise.', el.respond('sorry', second))
+        self.assertEqual('Please don\'t apologise.', el.respond('sorry'))
+        el.respond('My mother takes care of me.', first)
+        self.assertEqual(1, len(first.memory))
+        self.assertEqual(0, len(second.memory))
+        self.assertEqual(0, len(el.memory))
+
+    def test_memory_1(self):
+        memory = eliza.Memory(3)
+        for item in ['a', 'b', 'c', 'a', 'd']:
+            memory.add(item)
+        self.assertEqual(['c', 'a', 'd'], list(memory))
+        self.assertNotIn('b', memory)
+        memory.remove('c')
+        self.assertEqual(['a', 'd'], list(memory))
+        popped = set(memory.pop_random() for _ in range(2))
+        self.assertEqual({'a', 'd'}, popped)
+        self.assertEqual(0, len(memory))
+
+    def test_memory_2(self):
+        el = eliza.Eliza(memory_size=2)
+        el.load('doctor.txt')
+        session = el.new_session()
+        empty = session.footprint()
+        for text in ['My mother takes care of me.', 'My father is afraid.',
+                     'My sister is kind.', 'My father is afraid.']:
+            el.respond(text, session)
+        self.assertEqual(2, len(session.memory))
+        self.assertGreater(session.footprint(), empty)
+
+    def test_response_cache_1(self):
+        texts = ['Men are all alike.', 'My mother takes care of me.',
+                 'sorry', 'sorry', 'sorry', 'I remember my father.', 'Hello',
+                 'My mother takes care of me.', 'I am sad', 'I am sad'] * 5
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        random.seed(1)
+        expected = [el.respond(text) for text in texts]
+        el = eliza.Eliza(response_cache_size=64)
+        el.load('doctor.txt')
+        random.seed(1)
+        self.assertEqual(expected, [el.respond(text) for text in texts])
+        self.assertGreater(el.response_cache.hits, 0)
+
+    def test_reload_1(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'doctor.txt')
+        shutil.copy('doctor.txt', path)
+        el = eliza.Eliza()
+        el.load(path)
+        session = el.new_session()
+        watcher = el.watch(path, interval=3600)
+        self.addCleanup(watcher.stop)
+        self.assertEqual('Please don\'t apologise.', el.respond('sorry', session))
+        el.respond('My mother takes care of me.', session)
+        with open(path) as file:
+            script = file.read()
+        with open(path, 'w') as file:
+            file.write('key: zebra 50\n  decomp: *\n    reasmb: Stripes.\n')
+            file.write(script)
+        self.assertTrue(watcher.check())
+        self.assertEqual(1, el.script_version)
+        self.assertEqual('Stripes.', el.respond('a zebra', session))
+        self.assertEqual('Apologies are not necessary.',
+                         el.respond('sorry', session))
+        self.assertEqual(1, len(session.memory))
+        self.assertEqual('Please don\'t apologise.',
+                         el.respond('sorry', el.new_session()))
+
+        with open(path, 'a') as file:
+            file.write('no tag on this line\n')
+        self.assertFalse(watcher.check())
+        self.assertEqual(1, el.script_version)
+
+    def test_reload_2(self):
+        # a swap from another thread in the middle of a turn does not
+        # change the script that turn runs on
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'small.txt')
+        with open(path, 'w') as file:
+            file.write('key: xnone\n  decomp: *\n    reasmb: Go on.\n')
+        el = eliza.Eliza(response_cache_size=64)
+        el.load('doctor.txt')
+        small = el.compile_script(path)
+        sorted_keys = el._sorted_keys
+
+        def sorted_keys_then_swap(*args):
+            keys = sorted_keys(*args)
+            el.swap_script(small)
+            return keys
+        el._sorted_keys = sorted_keys_then_swap
+        self.assertEqual('Do you often think of the sea ?',
+                         el.respond('I remember the sea'))
+        del el._sorted_keys
+        self.assertEqual('Go on.', el.respond('I remember the sea'))
+
+    def test_stream_1(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        lines = io.StringIO('{"session": "a", "text": "sorry"}\n\n'
+                            '{"session": "b", "text": "sorry"}\n'
+                            '{"session": "a", "text": "sorry"}\n'
+                            '{"session": "a", "text": "bye"}\n'
+                            '{"session": "a", "text": "sorry"}\n')
+        out = io.StringIO()
+        eliza.write_records(el.stream(eliza.read_utterances(lines, jsonl=True)),
+                            out, jsonl=True, batch=2)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(['a', 'b', 'a', 'a', 'a'], [r['session'] for r in records])
+        self.assertEqual('Apologies are not necessary.', records[2]['response'])
+        self.assertEqual('quit', records[3]['event'])
+        self.assertEqual('Please don\'t apologise.', records[4]['response'])
+        with self.assertRaises(ValueError):
+            list(eliza.read_utterances(io.StringIO('{"session": "a"}\n'), True))
+
+    def test_respond_many_1(self):
+        texts = ['Men are all alike.', 'My mother takes care of me.',
+                 'sorry', 'Bullies.', 'I remember my father.', 'Hello',
+                 'Bullies.', 'bye', 'I am sad'] * 20
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        random.seed(7)
+        expected = [el.respond(text) for text in texts]
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        random.seed(7)
+        self.assertEqual(expected, el.respond_many(texts, chunk_size=16))
+
+    def test_respond_many_2(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        first = el.new_session()
+        second = el.new_session()
+        self.assertEqual(['Please don\'t apologise.', 'Please don\'t apologise.',
+                          'Apologies are not necessary.'],
+                         el.respond_many(['sorry'] * 3,
+                                         [first, second, first]))
+        with self.assertRaises(ValueError):
+            el.respond_many(['sorry'] * 3, [first])
+
+    def test_cache_1(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'doctor.txt')
+        shutil.copy('doctor.txt', path)
+        el = eliza.Eliza()
+        el.load(path)
+        self.assertTrue(os.path.exists(path + '.cache'))
+        cached = eliza.Eliza()
+        self.assertIsNone(cached._load_cache(path + '.cache',
+                                             (eliza.CACHE_VERSION, 'stale')))
+        cached.load(path)
+        self.assertEqual([k.word for k in el.keys.values()],
+                         [k.word for k in cached.keys.values()])
+        self.assertEqual('In what way ?', cached.respond('Men are all alike.'))
+        with open(path, 'a') as file:
+            file.write('key: zebra\n  decomp: *\n    reasmb: Stripes ?\n')
+        changed = eliza.Eliza()
+        changed.load(path)
+        self.assertEqual('Stripes ?', changed.respond('zebra'))
+
+    def test_cache_2(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'doctor.txt')
+        shutil.copy('doctor.txt', path)
+        # a cache written by `python eliza.py` loads when imported
+        subprocess.run([sys.executable, 'eliza.py', '--script', path, '--pipe'],
+                       input='sorry\n', universal_newlines=True, check=True,
+                       stdout=subprocess.DEVNULL)
+        with open(path, 'rb') as file:
+            digest = (eliza.CACHE_VERSION,
+                      hashlib.sha256(file.read()).hexdigest())
+        script = eliza.Eliza()._load_cache(path + '.cache', digest)
+        self.assertEqual(sorted(eliza.Eliza().compile_script(path).keys),
+                         sorted(script.keys))
+        # unreadable caches are misses, and the script is parsed again
+        planted = os.path.join(tmp, 'planted')
+        pickled = "cos\nmkdir\n(S'{}'\ntR.".format(planted).encode('utf-8')
+        for data in [pickled, b'c__main__\nKey\n.', marshal.dumps([digest]),
+                     b'junk']:
+            with open(path + '.cache', 'wb') as file:
+                file.write(data)
+            el = eliza.Eliza()
+            el.load(path)
+            self.assertEqual('In what way ?', el.respond('Men are all alike.'))
+        self.assertFalse(os.path.exists(planted))
+
+    def test_template_1(self):
+        template = eliza.compile_template(['Why', 'do', 'you', 'say', '(2)', '?'])
+        self.assertEqual((('Why', 'do', 'you', 'say'), 1, ('?',)), template)
+        el = eliza.Eliza()
+        output = el._reassemble(template, [['x'], ['your', 'mother', ',', 'hm']])
+        self.assertEqual(['Why', 'do', 'you', 'say', 'your', 'mother', '?'],
+                         output)
+
+    def test_link_1(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        self.assertIs(el.keys['what'], el.keys['why'].decomps[0].gotos[-1])
+        self.assertEqual((None,) * 3, el.keys['sorry'].decomps[0].gotos)
+        script = ['key: xnone', '  decomp: *', '    reasmb: Go on.']
+        for lines, message in [
+                (['  decomp: * i am *', '    reasmb: You are (3) .'],
+                 'Invalid result index 3'),
+                (['  decomp: *', '    reasmb: goto nowhere'],
+                 'Invalid goto key nowhere'),
+                (['key: a', '  decomp: *', '    reasmb: goto b',
+                  'key: b', '  decomp: *', '    reasmb: goto a'],
+                 'Goto cycle a -> b -> a')]:
+            compiled = eliza.Script()
+            compiled.parse(script + lines)
+            with self.assertRaisesRegex(ValueError, message):
+                compiled.compile()
+
+    def test_parse_1(self):
+        with self.assertRaises(ValueError):
+            eliza.Script().parse(['key: a', "''' not a tag '''"])
+        with self.assertRaises(ValueError):
+            eliza.Script().parse(['decomp: *'])
+        script = eliza.Script()
+        script.parse(['# comment', 'key: a', '  decomp: *', '    reasmb: b'])
+        self.assertEqual([['b']], script.keys['a'].decomps[0].reasmbs)
+
     def test_response_2(self):
         el = eliza.Eliza()
         el.load('doctor.txt')
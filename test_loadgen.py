@@ -0,0 +1,63 @@
+import asyncio
+import os
+import random
+import unittest
+import eliza
+import loadgen
+import my_eliza
+import server
+
+
+class LoadgenTest(unittest.TestCase):
+    def test_conversation(self):
+        rng = random.Random(0)
+        conversations = [loadgen.conversation(rng, 12, dict(loadgen.MIX, crisis=1))
+                         for _ in range(50)]
+        kinds = set(kind for c in conversations for kind, _ in c)
+        self.assertEqual({'keys', 'goto', 'memory', 'crisis', 'quit'}, kinds)
+        for c in conversations:
+            self.assertGreaterEqual(len(c), 13)
+            self.assertEqual('quit', c[-1][0])
+        self.assertEqual(conversations[0],
+                         loadgen.conversation(random.Random(0), 12,
+                                              dict(loadgen.MIX, crisis=1)))
+
+    def test_percentiles(self):
+        stats = loadgen.percentiles([i / 100.0 for i in range(100, 0, -1)])
+        self.assertEqual((0.5, 0.95, 0.99, 1.0), (stats['p50'], stats['p95'],
+                                                  stats['p99'], stats['max']))
+
+    def test_engine(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        target = loadgen.EngineTarget(el)
+        results = asyncio.run(loadgen.LoadGenerator(
+            target, conversations=40, concurrency=10, pid=os.getpid()).run())
+        self.assertEqual(0, results['errors'])
+        self.assertGreaterEqual(results['turns'], 40 * 13)
+        self.assertIn('goto', results['latency'])
+        self.assertGreater(results['samples'][0]['rss'], 0)
+        self.assertEqual(0, results['samples'][-1]['footprint'])
+
+    def test_socket(self):
+        el = my_eliza.Eliza(offline=True, crisis_report_path=None)
+        el.load('my_doctor.txt')
+
+        async def run():
+            listener = await server.ElizaServer(el).start(port=0)
+            port = listener.sockets[0].getsockname()[1]
+            try:
+                return await loadgen.LoadGenerator(
+                    loadgen.SocketTarget(port=port), conversations=20,
+                    concurrency=5, mix=dict(loadgen.MIX, crisis=2)).run()
+            finally:
+                listener.close()
+                await listener.wait_closed()
+        results = asyncio.run(run())
+        self.assertEqual(0, results['errors'])
+        self.assertIn('crisis', results['latency'])
+        self.assertIsNone(results['rss_growth'])
+
+
+if __name__ == '__main__':
+    unittest.main()
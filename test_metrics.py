@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+import eliza
+import my_eliza
+from metrics import Metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram(self):
+        metrics = Metrics(buckets=(0.001, 0.01))
+        for seconds in (0.0005, 0.001, 0.005, 2.0):
+            metrics.observe('tokenize', seconds)
+        self.assertEqual(4, metrics.count('tokenize'))
+        text = metrics.format()
+        self.assertIn('eliza_stage_seconds_bucket{stage="tokenize",le="0.001"} 2',
+                      text)
+        self.assertIn('eliza_stage_seconds_bucket{stage="tokenize",le="0.01"} 3',
+                      text)
+        self.assertIn('eliza_stage_seconds_bucket{stage="tokenize",le="+Inf"} 4',
+                      text)
+        self.assertIn('eliza_stage_seconds_count{stage="tokenize"} 4', text)
+
+    def test_instrument(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        plain = eliza.Eliza()
+        plain.load('doctor.txt')
+        metrics = Metrics()
+        el.instrument(metrics)
+        texts = ['Men are all alike.', 'I remember my mother', 'Hello',
+                 'blah', 'My mother takes care of me.', 'blah']
+        self.assertEqual([plain.respond(t) for t in texts],
+                         [el.respond(t) for t in texts])
+        self.assertEqual(6, metrics.count('respond'))
+        self.assertEqual(6, metrics.count('tokenize'))
+        self.assertEqual(1, metrics.count('xnone'))
+        self.assertEqual(1, metrics.count('memory'))
+        self.assertGreater(metrics.count('match_key'), 0)
+        self.assertRaises(ValueError, el.instrument, metrics)
+        self.assertIsNone(plain.metrics)
+
+    def test_instrument_my_eliza(self):
+        el = my_eliza.Eliza(offline=True)
+        el.load('my_doctor.txt')
+        el.nlp_models.update(sentiment=None, tagger=None, chunker=None)
+        metrics = Metrics()
+        el.instrument(metrics)
+        el.respond('I am sad')
+        self.assertEqual(1, metrics.count('crisis'))
+        self.assertEqual(1, metrics.count('pos_chunking'))
+
+    def test_write(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'eliza.prom')
+        metrics = Metrics()
+        metrics.observe('respond', 0.002)
+        metrics.write(path)
+        with open(path) as file:
+            self.assertEqual(metrics.format(), file.read())
+        self.assertEqual(['eliza.prom'], os.listdir(tmp))
+
+
+if __name__ == '__main__':
+    unittest.main()
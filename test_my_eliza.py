@@ -0,0 +1,269 @@
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import eliza
+import my_eliza
+
+class FakeTree:
+    def __init__(self, label, children):
+        self._label = label
+        self.children = children
+
+    def label(self):
+        return self._label
+
+    def leaves(self):
+        return self.children
+
+    def subtrees(self, filter):
+        return [c for c in self.children
+                if isinstance(c, FakeTree) and filter(c)]
+
+
+class FakeTagger:
+    def __init__(self):
+        self.calls = 0
+
+    def tag(self, words):
+        self.calls += 1
+        return [(w, 'NN' if w.istitle() else 'VB') for w in words]
+
+    def tag_sents(self, sentences):
+        return [self.tag(words) for words in sentences]
+
+
+class BlockingTagger(FakeTagger):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def tag_sents(self, sentences):
+        self.release.wait(5)
+        return super().tag_sents(sentences)
+
+
+class FakeChunker:
+    def parse(self, tags):
+        return FakeTree('S', [FakeTree('NP', [t for t in tags
+                                              if t[1] == 'NN'])])
+
+
+class FakeSentiment:
+    def __init__(self):
+        self.calls = 0
+
+    def polarity_scores(self, text):
+        self.calls += 1
+        return {'compound': -0.6 if 'sad' in text else 0.3}
+
+
+# Budget for `import my_eliza` plus `Eliza()` in a fresh interpreter.
+STARTUP_SECONDS = 0.5
+
+
+class MyElizaTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.el = my_eliza.Eliza(
+            offline=True, crisis_report_path=os.path.join(tmp, 'reports.jsonl'))
+        self.el.load('my_doctor.txt')
+        self.addCleanup(lambda: self.el.crisis_reports and
+                        self.el.crisis_reports.close())
+
+    def _reports(self):
+        """Return the answers of each crisis report self.el has written."""
+        if self.el.crisis_reports is None:
+            return []
+        self.el.crisis_reports.flush()
+        with open(self.el.crisis_report_path) as file:
+            return [list(json.loads(line)['responses'].values()) for line in file]
+
+    def test_startup(self):
+        code = ('import sys, time\n'
+                'start = time.perf_counter()\n'
+                'import my_eliza\n'
+                'my_eliza.Eliza()\n'
+                'print(time.perf_counter() - start)\n'
+                'print("nltk" in sys.modules)\n')
+        out = subprocess.check_output([sys.executable, '-c', code],
+                                      universal_newlines=True).split()
+        self.assertLess(float(out[0]), STARTUP_SECONDS)
+        self.assertEqual('False', out[1])
+
+    def test_crisis(self):
+        session = self.el.new_session()
+        self.assertEqual(self.el.crisis_questions[0],
+                         self.el.respond('I want to die', session))
+        for question, answer in zip(self.el.crisis_questions[1:],
+                                    ['bad', 'very', 'hours']):
+            self.assertEqual(question, self.el.respond(answer, session))
+        self.assertIn('Crisis Text Line', self.el.respond('no', session))
+        self.assertEqual([['bad', 'very', 'hours', 'no']], self._reports())
+        self.assertIsNone(session.crisis_responses)
+
+    def test_crisis_report(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'reports.jsonl')
+        el = my_eliza.Eliza(offline=True, crisis_report_path=path)
+        el.load('my_doctor.txt')
+        for session_id in ['first', 'second']:
+            session = el.new_session(session_id)
+            for text in ['I want to die', 'bad', 'very', 'hours', 'yes']:
+                el.respond(text, session)
+        el.crisis_reports.close()
+        with open(path) as file:
+            reports = [json.loads(line) for line in file]
+        self.assertEqual(['first', 'second'], [r['session'] for r in reports])
+        self.assertEqual('High', reports[0]['risk'])
+        self.assertEqual('hours', reports[1]['responses']['Duration Report'])
+
+    def test_crisis_report_off(self):
+        el = eliza.load_engine('my_eliza', crisis_report_path=None, offline=True)
+        session = el.new_session()
+        for text in ['I want to die', 'bad', 'very', 'hours']:
+            el.respond(text, session)
+        self.assertIn('Crisis Text Line', el.respond('yes', session))
+        self.assertIsNone(el.crisis_reports)
+
+    def test_crisis_report_unwritable(self):
+        el = my_eliza.Eliza(offline=True,
+                            crisis_report_path=os.path.join('missing', 'r.jsonl'))
+        el.load('my_doctor.txt')
+        session = el.new_session()
+        for text in ['I want to die', 'bad', 'very', 'hours']:
+            el.respond(text, session)
+        with self.assertLogs('my_eliza', 'ERROR'):
+            self.assertIn('Crisis Text Line', el.respond('yes', session))
+        self.assertIsNone(el.crisis_reports)
+
+    def test_noun_phrases(self):
+        tagger = FakeTagger()
+        self.el.nlp_models.update(tagger=tagger, chunker=FakeChunker())
+        words = ['I', 'saw', 'Big', 'Ben']
+        self.assertEqual(('I Big Ben',), self.el.noun_phrases(words))
+        self.assertEqual(('I Big Ben',), self.el.noun_phrases(list(words)))
+        self.assertEqual(1, tagger.calls)
+        self.el.respond('I saw Big Ben')
+        self.assertEqual(['I Big Ben'], list(self.el.session.memory_keys))
+
+    def _fake_models(self, el):
+        el.nlp_models.update(tagger=FakeTagger(), chunker=FakeChunker(),
+                             sentiment=FakeSentiment())
+        return el
+
+    def test_respond_many(self):
+        texts = ['I saw Big Ben today', 'yes', 'yes', 'I am sad about my Mother',
+                 'My Father is very kind to me', 'no', 'Hello there',
+                 'I feel so sad and alone'] * 20
+        el = self._fake_models(my_eliza.Eliza(offline=True))
+        el.load('my_doctor.txt')
+        random.seed(3)
+        expected = [el.respond(text) for text in texts]
+        el = self._fake_models(my_eliza.Eliza(offline=True))
+        el.load('my_doctor.txt')
+        random.seed(3)
+        self.assertEqual(expected, el.respond_many(texts, chunk_size=32))
+        self.assertLessEqual(el.nlp_models['sentiment'].calls, 5 * 4)
+
+    def test_sentiment_cache(self):
+        sia = FakeSentiment()
+        sia.lexicon = {'sad': -2.1}
+        self.el.nlp_models['sentiment'] = sia
+        self.assertEqual(-0.6, self.el.sentiment_score('I feel sad.'))
+        self.assertEqual(-0.6, self.el.sentiment_score(' I  feel sad. '))
+        self.assertEqual(0.0, self.el.sentiment_score('I went home'))
+        self.assertEqual(1, sia.calls)
+        stats = self.el.cache_stats()['sentiment']
+        self.assertEqual((1, 2, 1), (stats['hits'], stats['misses'],
+                                     stats['skipped']))
+
+    def test_cache_sizes(self):
+        el = my_eliza.Eliza(offline=True, sentiment_cache_size=1,
+                            noun_phrase_cache_size=0)
+        sia = FakeSentiment()
+        el.nlp_models.update(sentiment=sia, tagger=FakeTagger(),
+                             chunker=FakeChunker())
+        for text in ['I feel sad.', 'I feel fine.', 'I feel sad.']:
+            el.sentiment_score(text)
+        self.assertEqual(3, sia.calls)
+        self.assertEqual(1, el.cache_stats()['sentiment']['size'])
+        words = ['I', 'like', 'the', 'red', 'car']
+        self.assertEqual(el.noun_phrases(words), el.noun_phrases(words))
+        self.assertEqual({}, el.cache_stats()['noun_phrases'])
+
+    def test_stream(self):
+        utterances = [('a', 'I want to die'), ('b', 'Hello'), ('a', 'bad'),
+                      ('a', 'very'), ('a', 'hours'), ('a', 'no')]
+        records = list(self.el.stream(utterances))
+        self.assertEqual(['crisis', None, 'crisis', 'crisis', 'crisis',
+                          'crisis_complete'],
+                         [r.get('event') for r in records])
+        self.assertEqual('Plan', records[4]['topic'])
+        self.assertEqual(self.el.crisis_resources, records[5]['resources'])
+        self.assertEqual(1, len(self._reports()))
+
+    def _pooled(self, tagger, **options):
+        el = my_eliza.Eliza(offline=True, nlp_workers=1, **options)
+        self.addCleanup(el.nlp_pool.shutdown)
+        el.load('my_doctor.txt')
+        el.nlp_models.update(tagger=tagger, chunker=FakeChunker(),
+                             sentiment=None)
+        return el
+
+    def test_nlp_pool(self):
+        el = self._pooled(FakeTagger())
+        session = el.new_session()
+        output = asyncio.run(el.respond_async('I saw Big Ben', session))
+        self.assertTrue(output)
+        self.assertEqual(['I Big Ben'], list(session.memory_keys))
+        self.assertEqual(1, el.nlp_pool.stats()['completed'])
+
+    def test_nlp_pool_degrade(self):
+        tagger = BlockingTagger()
+        el = self._pooled(tagger, nlp_deadline=0.05, nlp_queue=1)
+        first, second = el.new_session(), el.new_session()
+
+        async def turns():
+            return await asyncio.gather(
+                el.respond_async('I saw Big Ben', first),
+                el.respond_async('I saw Big Ben', second))
+        self.addCleanup(tagger.release.set)
+        outputs = asyncio.run(turns())
+        self.assertTrue(all(outputs))
+        self.assertEqual([], list(first.memory_keys) + list(second.memory_keys))
+        stats = el.nlp_pool.stats()
+        self.assertEqual((1, 1, 0), (stats['saturated'], stats['timeouts'],
+                                     stats['completed']))
+
+    def test_nlp_pool_swap(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'my_doctor.txt')
+        shutil.copy('my_doctor.txt', path)
+        with open(path, 'a') as file:
+            file.write('quit: adieu\n')
+        tagger = FakeTagger()
+        el = self._pooled(tagger)
+        script = el.compile_script(path)
+        # swapped while the turn waits on the pool
+        tagger.tag = lambda words: el.swap_script(script) or []
+        session = el.new_session()
+        self.assertIsNone(asyncio.run(el.respond_async('adieu', session)))
+        self.assertEqual(script.digest, el.script.digest)
+
+    def test_repeat(self):
+        self.el.respond('yes')
+        self.assertIn('repeating yourself', self.el.respond('yes'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import json
+import unittest
+import replay
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        utterances = ['Men are all alike.', 'My mother takes care of me.',
+                      'Bullies.', 'I am unhappy.', 'Bullies.', 'Hello']
+        self.lines = [json.dumps({'id': 'c{}'.format(i),
+                                  'utterances': utterances[i % 3:]})
+                      for i in range(12)]
+
+    def test_replay(self):
+        results = list(replay.replay(self.lines, workers=1))
+        self.assertEqual(['c{}'.format(i) for i in range(12)],
+                         [r['id'] for r in results])
+        self.assertEqual('In what way ?', results[0]['responses'][0])
+        self.assertEqual(results, list(replay.replay(self.lines, workers=1)))
+
+    def test_workers(self):
+        self.assertEqual(list(replay.replay(self.lines, workers=1, seed=5)),
+                         list(replay.replay(self.lines, workers=2, seed=5,
+                                            chunksize=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
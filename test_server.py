@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+import eliza
+import my_eliza
+import server
+
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        self.server = server.ElizaServer(el)
+        self.listener = await self.server.start(port=0)
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.listener.close()
+        await self.listener.wait_closed()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        greeting = await reader.readline()
+        self.assertEqual(b'How do you do.  Please tell me your problem.\n',
+                         greeting)
+        return reader, writer
+
+    async def _say(self, reader, writer, text):
+        writer.write((text + '\n').encode('utf-8'))
+        await writer.drain()
+        return (await reader.readline()).decode('utf-8').rstrip('\n')
+
+    async def test_conversation(self):
+        reader, writer = await self._connect()
+        self.assertEqual('In what way ?',
+                         await self._say(reader, writer, 'Men are all alike.'))
+        self.assertEqual('Goodbye.  Thank you for talking to me.',
+                         await self._say(reader, writer, 'bye'))
+        self.assertEqual(b'', await reader.readline())
+        writer.close()
+
+    async def test_sessions_are_independent(self):
+        clients = [await self._connect() for _ in range(50)]
+        replies = await asyncio.gather(
+            *[self._say(r, w, 'sorry') for r, w in clients])
+        self.assertEqual(['Please don\'t apologise.'] * 50, replies)
+        self.assertEqual(50, self.server.connections)
+        for _, writer in clients:
+            writer.close()
+
+    async def test_long_line(self):
+        reader, writer = await self._connect()
+        for size in [2 ** 16 + 1, 2 ** 20]:
+            self.assertEqual(self.server.too_long,
+                             await self._say(reader, writer, 'a' * size))
+        self.assertEqual('In what way ?',
+                         await self._say(reader, writer, 'Men are all alike.'))
+        writer.close()
+
+    async def test_multiline_reply(self):
+        el = my_eliza.Eliza(offline=True, crisis_report_path=None)
+        el.load('my_doctor.txt')
+        self.server.engine = el
+        reader, writer = await self._connect()
+        for text in ['I want to die', 'bad', 'very', 'hours']:
+            await self._say(reader, writer, text)
+        self.assertIn('Crisis Text Line', await self._say(reader, writer, 'no'))
+        self.assertEqual('Goodbye.  Thank you for talking to me.',
+                         await self._say(reader, writer, 'bye'))
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+import eliza
+import my_eliza
+from sessions import SessionStore
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_eliza(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        session = el.new_session()
+        el.respond('sorry', session)
+        el.respond('My mother takes care of me.', session)
+        restored = el.load_session(el.dump_session(session))
+        self.assertEqual(session.id, restored.id)
+        self.assertEqual(list(session.memory), list(restored.memory))
+        self.assertEqual('Apologies are not necessary.',
+                         el.respond('sorry', restored))
+
+    def test_my_eliza(self):
+        el = my_eliza.Eliza(offline=True)
+        el.load('my_doctor.txt')
+        el.nlp_models.update(sentiment=None, tagger=None, chunker=None)
+        session = el.new_session()
+        session.memory_keys.add('Big Ben')
+        el.respond('I want to die', session)
+        el.respond('They come and go', session)
+        restored = el.load_session(el.dump_session(session))
+        self.assertEqual(['Big Ben'], list(restored.memory_keys))
+        self.assertEqual('i want to die', restored.last_input)
+        self.assertEqual(['They come and go'], restored.crisis_responses)
+
+    def test_other_script(self):
+        el = eliza.Eliza()
+        el.load('doctor.txt')
+        session = el.new_session()
+        el.respond('sorry', session)
+        data = el.dump_session(session)
+        other = eliza.Eliza()
+        other.load('my_doctor.txt')
+        self.assertEqual({}, other.load_session(data).reasmb_indices)
+        with self.assertRaises(ValueError):
+            el.load_session(data[:-3])
+        with self.assertRaises(ValueError):
+            el.load_session(b'junk')
+
+
+class SessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'sessions.log')
+        self.el = eliza.Eliza()
+        self.el.load('doctor.txt')
+
+    def test_store(self):
+        with SessionStore(self.path) as store:
+            for i in range(100):
+                session = self.el.new_session('s{}'.format(i))
+                self.el.respond('sorry', session)
+                store.save(self.el, session)
+            store.save(self.el, session)
+            store.delete('s0')
+        with SessionStore(self.path) as store:
+            self.assertEqual(99, len(store))
+            self.assertIsNone(store.load(self.el, 's0'))
+            session = store.load(self.el, 's5')
+            self.assertEqual('Apologies are not necessary.',
+                             self.el.respond('sorry', session))
+            size = os.path.getsize(self.path)
+            store.compact()
+            self.assertLess(os.path.getsize(self.path), size)
+            self.assertEqual(session.id, store.load(self.el, 's5').id)
+            store.save(self.el, session)
+        with SessionStore(self.path) as store:
+            self.assertEqual(99, len(store))
+            self.assertEqual('I\'ve told you that apologies are not required.',
+                             self.el.respond('sorry', store.load(self.el, 's5')))
+
+    def test_torn_write(self):
+        with SessionStore(self.path) as store:
+            store.put('a', b'first')
+            store.put('b', b'second')
+        with open(self.path, 'r+b') as file:
+            file.truncate(os.path.getsize(self.path) - 2)
+        with SessionStore(self.path) as store:
+            self.assertEqual(['a'], list(store))
+            store.put('c', b'third')
+        with SessionStore(self.path) as store:
+            self.assertEqual(b'third', store.get('c'))
+
+
+if __name__ == '__main__':
+    unittest.main()